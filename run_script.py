@@ -0,0 +1,19 @@
+import argparse
+
+from antlr4 import FileStream
+
+from wrappers import ParseTreeWrapper, QueryInterpreter
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-i', '--input', help='Path to query language script to execute')
+    parser.add_argument('-d', '--db', default=None, help='Path to the graph database used until `connect`')
+    args = parser.parse_args()
+    wrapper = ParseTreeWrapper(FileStream(args.input))
+    if wrapper.ast is not None:
+        for result in QueryInterpreter(args.db).run(wrapper):
+            if isinstance(result, int):
+                print(result)
+            else:
+                for node_from, label, node_to in sorted(result, key=lambda edge: (edge[0], str(edge[1]), edge[2])):
+                    print(f'{node_from} {label} {node_to}')
@@ -0,0 +1,115 @@
+import argparse
+import json
+import os
+import time
+from multiprocessing import get_context
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from solve_rpq import solve_rpq
+from wrappers import GraphWrapper, GrammarWrapper, RegexGraphWrapper
+
+_graph: Optional[GraphWrapper] = None
+
+
+class BatchResult(NamedTuple):
+    query_path: str
+    reachable_pairs: Union[Set[Tuple[int, int]], Tuple[np.ndarray, np.ndarray]]
+    load_time_ms: int
+    solve_time_ms: int
+
+    @property
+    def pairs_num(self) -> int:
+        if isinstance(self.reachable_pairs, tuple):
+            return len(self.reachable_pairs[0])
+        return len(self.reachable_pairs)
+
+
+def _init_worker(path_to_binary: str):
+    global _graph
+    _graph = GraphWrapper.load_binary(path_to_binary, use_mmap=True)
+
+
+def _solve_rpq_task(task: Tuple[str, Dict, bool]) -> BatchResult:
+    path_to_regex, query, is_python_regex = task
+    start_time = time.time_ns()
+    constraint = RegexGraphWrapper.from_regex_file(path_to_regex, is_python_regex)
+    load_time = time.time_ns()
+    reachable_pairs = solve_rpq(_graph, constraint, query, as_arrays=True)
+    end_time = time.time_ns()
+    return BatchResult(path_to_regex, reachable_pairs,
+                       (load_time - start_time) // 1000000, (end_time - load_time) // 1000000)
+
+
+def _solve_cfpq_task(task: Tuple[str, str]) -> BatchResult:
+    path_to_grammar, algo = task
+    start_time = time.time_ns()
+    grammar = GrammarWrapper.from_file(path_to_grammar)
+    load_time = time.time_ns()
+    reachable_pairs = _graph.__getattribute__(f'cfpq_{algo}')(grammar)
+    end_time = time.time_ns()
+    return BatchResult(path_to_grammar, reachable_pairs,
+                       (load_time - start_time) // 1000000, (end_time - load_time) // 1000000)
+
+
+def _run_batch(path_to_graph: str, task_func, tasks: List, processes: Optional[int]) -> Iterator[BatchResult]:
+    # Parse the graph once: workers memory-map the same binary copy instead of re-reading the text.
+    # Only the file pages are shared, every worker still builds its own copy of the matrices from them
+    GraphWrapper.from_file_with_binary_cache(path_to_graph)
+    # GraphBLAS has already run in this process, and a forked OpenMP runtime may hang, so workers are spawned
+    context = get_context('spawn')
+    with context.Pool(processes, initializer=_init_worker, initargs=(f'{path_to_graph}.bin',)) as pool:
+        yield from pool.imap_unordered(task_func, tasks)
+
+
+def solve_rpq_batch(path_to_graph: str, paths_to_regexes: List[str],
+                    query: Dict[str, Union[bool, str, List[int]]],
+                    processes: Optional[int] = None, is_python_regex=True) -> Iterator[BatchResult]:
+    tasks = [(path_to_regex, query, is_python_regex) for path_to_regex in paths_to_regexes]
+    return _run_batch(path_to_graph, _solve_rpq_task, tasks, processes)
+
+
+def solve_cfpq_batch(path_to_graph: str, paths_to_grammars: List[str], algo: str = 'matrices',
+                     processes: Optional[int] = None) -> Iterator[BatchResult]:
+    tasks = [(path_to_grammar, algo) for path_to_grammar in paths_to_grammars]
+    return _run_batch(path_to_graph, _solve_cfpq_task, tasks, processes)
+
+
+def main():
+    # Parse command line arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path_to_graph",
+                        help="input file with list of edges of the graph in format 'v_from label v_to'")
+    parser.add_argument("paths_to_queries", nargs='+',
+                        help="input files with regexes (RPQ) or grammars (CFPQ), one query per file")
+    parser.add_argument("--cfpq", action='store_true',
+                        help="treat query files as grammars instead of regexes")
+    parser.add_argument("--query", default=None,
+                        help="input file with specified set of vertices for RPQ (all pairs by default)")
+    parser.add_argument("--algo", default='matrices', choices=['hellings', 'matrices', 'tensors'],
+                        help="CFPQ algorithm")
+    parser.add_argument("--pyformlang-regex", action='store_true',
+                        help="parse regexes with `pyformlang.regular_expression.Regex` syntax")
+    parser.add_argument("-p", "--processes", type=int, default=os.cpu_count(),
+                        help="number of worker processes")
+    args = parser.parse_args()
+
+    if args.cfpq:
+        results = solve_cfpq_batch(args.path_to_graph, args.paths_to_queries, args.algo, args.processes)
+    else:
+        query = {'reachability_between_all': True}
+        if args.query is not None:
+            with open(args.query, 'r') as file:
+                query = json.load(file)
+        results = solve_rpq_batch(args.path_to_graph, args.paths_to_queries, query,
+                                  args.processes, not args.pyformlang_regex)
+
+    # Results are printed in order of completion
+    for result in results:
+        print(f'{result.query_path}: {result.pairs_num} reachable pairs, '
+              f'load {result.load_time_ms} ms, solve {result.solve_time_ms} ms', flush=True)
+
+
+if __name__ == '__main__':
+    main()
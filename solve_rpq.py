@@ -1,12 +1,39 @@
 import argparse
 import json
+from itertools import product
 from typing import Set, Tuple, Dict, Union, List
 
+import numpy as np
+
 from wrappers import GraphWrapper, RegexGraphWrapper
 
 
 def solve_rpq(graph: GraphWrapper, constraint: RegexGraphWrapper,
-              query: Dict[str, Union[bool, List[int]]]) -> Set[Tuple[int, int]]:
+              query: Dict[str, Union[bool, str, List[int]]],
+              as_arrays=False) -> Union[Set[Tuple[int, int]], Tuple[np.ndarray, np.ndarray], bool, int]:
+    mapping = graph.vertex_mapping
+    if mapping is None:
+        return _solve_rpq(graph, constraint, query, as_arrays)
+    # Vertex sets of the query and the answer use external ids of the compacted graph
+    query = dict(query)
+    for key in ['reachability_from_set', 'reachability_to_set']:
+        if key in query:
+            query[key] = mapping.to_internal(query[key])
+    result = _solve_rpq(graph, constraint, query, as_arrays)
+    if isinstance(result, (bool, int)):
+        return result
+    return mapping.to_external_arrays(*result) if as_arrays else mapping.to_external_pairs(result)
+
+
+def _solve_rpq(graph: GraphWrapper, constraint: RegexGraphWrapper,
+               query: Dict[str, Union[bool, str, List[int]]],
+               as_arrays=False) -> Union[Set[Tuple[int, int]], Tuple[np.ndarray, np.ndarray], bool, int]:
+    strategy = query.get('strategy', 'tensor')
+    if strategy == 'bfs':
+        return solve_rpq_by_bfs(graph, constraint, query, as_arrays)
+    elif strategy != 'tensor':
+        raise KeyError(f"Unknown RPQ evaluation strategy: {strategy}")
+
     # Calculate kronecker (tensor) product, prepare indices
     intersection = constraint.kronecker_product(graph)
     step = graph.vertices_num
@@ -15,24 +42,63 @@ def solve_rpq(graph: GraphWrapper, constraint: RegexGraphWrapper,
     if query.get('reachability_between_all'):
         start_idxs, end_idxs = intersection.start_states, intersection.final_states
     elif "reachability_from_set" in query and "reachability_to_set" not in query:
-        graph_start_idxs = set(query.get("reachability_from_set"))
-        start_idxs = set([idx for idx in intersection.start_states if (idx % step) in graph_start_idxs])
+        start_idxs = intersection.start_states.restrict(query.get("reachability_from_set"))
         end_idxs = intersection.final_states
     elif "reachability_from_set" in query and "reachability_to_set" in query:
-        graph_start_idxs = set(query.get("reachability_from_set"))
-        graph_end_idxs = set(query.get("reachability_to_set"))
-        start_idxs = set([idx for idx in intersection.start_states if (idx % step) in graph_start_idxs])
-        end_idxs = set([idx for idx in intersection.final_states if (idx % step) in graph_end_idxs])
+        start_idxs = intersection.start_states.restrict(query.get("reachability_from_set"))
+        end_idxs = intersection.final_states.restrict(query.get("reachability_to_set"))
     else:
         raise KeyError("Incorrect format of the input query")
 
+    # Answer existence and count queries without enumerating pairs
+    if query.get('exists'):
+        return intersection.has_reachable_pair(start_idxs, end_idxs)
+    if query.get('count_only'):
+        return intersection.count_reachable_pairs(start_idxs, end_idxs, modulo=step)
+
     # Collect reachable pairs from resulting automaton using transitive closure
-    reachable_pairs = intersection.get_reachable_pairs(start_idxs, end_idxs)
-    initial_reachable_pairs = set([(pair[0] % step, pair[1] % step) for pair in reachable_pairs])
+    if query.get('closure', 'frontier') == 'condensed':
+        # Blocks are projected onto graph vertices one at a time, only the answer itself is materialised
+        pairs = set()
+        for sources, targets in intersection.build_closure_by_condensation().iter_blocks(start_idxs, end_idxs):
+            pairs.update(product(np.unique(sources % step).tolist(), np.unique(targets % step).tolist()))
+        if not as_arrays:
+            return pairs
+        pairs_array = np.array(sorted(pairs), dtype=np.int64).reshape(-1, 2)
+        return pairs_array[:, 0], pairs_array[:, 1]
+    elif query.get('closure', 'frontier') == 'frontier':
+        rows, cols = intersection.get_reachable_pairs(start_idxs, end_idxs, as_arrays=True)
+    else:
+        raise KeyError(f"Unknown transitive closure mode: {query.get('closure')}")
+    if as_arrays:
+        return GraphWrapper._unique_pairs(rows % step, cols % step)
+    initial_reachable_pairs = set(zip((rows % step).tolist(), (cols % step).tolist()))
 
     return initial_reachable_pairs
 
 
+def solve_rpq_by_bfs(graph: GraphWrapper, constraint: RegexGraphWrapper,
+                     query: Dict[str, Union[bool, str, List[int]]],
+                     as_arrays=False) -> Union[Set[Tuple[int, int]], Tuple[np.ndarray, np.ndarray], bool, int]:
+    # Parse query from JSON, the product automaton is never built
+    if query.get('reachability_between_all'):
+        start_idxs, end_idxs = range(graph.vertices_num), None
+    elif "reachability_from_set" in query and "reachability_to_set" not in query:
+        start_idxs, end_idxs = set(query.get("reachability_from_set")), None
+    elif "reachability_from_set" in query and "reachability_to_set" in query:
+        start_idxs = set(query.get("reachability_from_set"))
+        end_idxs = set(query.get("reachability_to_set"))
+    else:
+        raise KeyError("Incorrect format of the input query")
+
+    # Traverse pairs (DFA state, graph vertex) from all start vertices simultaneously
+    if query.get('exists'):
+        return graph.has_reachable_pair_by_bfs(constraint, start_idxs, end_idxs)
+    if query.get('count_only'):
+        return graph.count_reachable_pairs_by_bfs(constraint, start_idxs, end_idxs)
+    return graph.get_reachable_pairs_by_bfs(constraint, start_idxs, end_idxs, as_arrays)
+
+
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser()
@@ -43,15 +109,25 @@ def main():
     parser.add_argument("path_to_query",
                         help="input file with specified set of vertices in the input graph "
                              "using regex for finding reachability")
+    parser.add_argument("--compact", default=None, choices=['identity', 'bfs', 'degree'],
+                        help="renumber vertices densely (vertex names may be arbitrary strings) in the given order")
     args = parser.parse_args()
 
     # Load initial data: graph, regexp, query
-    graph = GraphWrapper.from_file(args.path_to_graph)
+    graph = GraphWrapper.from_file(args.path_to_graph, compact=args.compact is not None)
+    if args.compact is not None and args.compact != 'identity':
+        graph = graph.compact(args.compact)
     constraint = RegexGraphWrapper.from_regex_file(args.path_to_regex)
     with open(args.path_to_query, 'r') as file:
         query = json.load(file)
 
     initial_reachable_pairs = solve_rpq(graph, constraint, query)
+    if query.get('exists'):
+        print(f"Reachable pair exists: {initial_reachable_pairs}")
+        return
+    if query.get('count_only'):
+        print(f"Number of reachable pairs: {initial_reachable_pairs}")
+        return
     print("Reachable pairs of indices:")
     for start_idx, end_idx in initial_reachable_pairs:
         print(f'{start_idx} ~~> {end_idx}')
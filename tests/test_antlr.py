@@ -69,3 +69,72 @@ def test_antlr(suite):
         assert ast.graph is None
     else:
         assert get_number_of_vertices_and_edges(ast.graph) == (expected, expected - 1)
+
+
+@pytest.fixture(scope="function")
+def db(tmp_path, monkeypatch):
+    (tmp_path / 'db').mkdir()
+    (tmp_path / 'db' / 'g.txt').write_text('\n'.join(['0 a 1', '1 a 2', '2 a 0', '2 b 3', '3 b 2']))
+    monkeypatch.chdir(tmp_path)
+    return './db'
+
+
+def test_interpreter(db):
+    from wrappers import QueryInterpreter
+    script = ParseTreeWrapper(InputStream(f'''
+    connect "{db}";
+    production var(S) to (term(a) . var(S) . term(b) . var(S)) | eps;
+    select edges from (query grammar intersect name "g");
+    select (count edges) from (name "g");
+    select (count (filter ((u, e, v) -> (e has_label "a" and not is_final v), edges)))
+        from (set_start_and_final (none, {{1, 2}}, name "g"));
+    select (filter ((u, e, v) -> (is_start u || is_start v), edges)) from (set_start_and_final ({{3}}, none, name "g"));
+    select (count edges) from (query [(term(a))+] intersect set_start_and_final ({{0}}, none, name "g"));
+    select edges from (query grammar intersect (name "g" intersect name "g"));
+    '''))
+    results = QueryInterpreter().run(script)
+    assert results == [
+        set([(i, 'S', j) for i, j in [(0, 0), (1, 1), (2, 2), (3, 3), (0, 2), (1, 2), (1, 3), (2, 3), (0, 3)]]),
+        5,
+        1,
+        {(2, 'b', 3), (3, 'b', 2)},
+        3,
+        set([(i, 'S', j) for i, j in [(v, v) for v in range(16)] + [(0, 10), (0, 15), (5, 10), (5, 15), (10, 15)]])
+    ]
+
+
+def test_interpreter_filter_pushdown(db):
+    from wrappers import QueryInterpreter
+    script = ParseTreeWrapper(InputStream(f'''
+    connect "{db}";
+    select (count (filter ((u, e, v) -> (e has_label "b" and is_start u), edges)))
+        from (set_start_and_final ({{2}}, none, name "g") intersect name "g");
+    select (count (filter ((u, e, v) -> (e has_label "b" || is_final v), edges))) from (name "g" intersect name "g");
+    select (filter ((u, e, v) -> (not (e has_label "a" || is_start u)), edges))
+        from (set_start_and_final ({{3}}, none, name "g"));
+    '''))
+    results = QueryInterpreter().run(script)
+    assert results == [2, 13, {(2, 'b', 3)}]
+
+
+def test_graph_catalog(db, tmp_path):
+    import os
+    from wrappers import GraphCatalog, QueryInterpreter
+    (tmp_path / 'db' / 'h.txt').write_text('0 c 1')
+    catalog = GraphCatalog(db, max_nvals=5)
+    assert catalog.names() == ['g', 'h']
+    script = ParseTreeWrapper(InputStream('''
+    select (count edges) from (name "g");
+    select (count edges) from (name "g" intersect name "g");
+    '''))
+    assert QueryInterpreter(catalog=catalog).run(script) == [5, 13]
+    assert (catalog.misses, catalog.hits, catalog.cached_nvals) == (1, 2, 5)
+
+    assert catalog.get('h').vertices == {0, 1}
+    assert 'h' in catalog and 'g' not in catalog and catalog.cached_nvals == 1
+
+    path = tmp_path / 'db' / 'h.txt'
+    path.write_text('0 c 1\n1 c 2')
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    assert catalog.get('h').vertices == {0, 1, 2}
+    assert (len(catalog), catalog.cached_nvals) == (1, 2)
@@ -17,8 +17,9 @@ except FileNotFoundError:
 csv_path = os.path.join(data_path, 'benchmark.csv')
 csv_fieldnames = ['suite', 'graph', 'grammar',
                   'cnf_load_time', 'rfa_load_time',
-                  'cnf_hellings_time', 'cnf_matrices_time',
-                  'cfg_tensors_time', 'cnf_tensors_time', 'rfa_tensors_time']
+                  'cnf_hellings_time', 'cnf_hellings_blocked_time', 'cnf_matrices_time', 'cnf_matrices_delta_time',
+                  'cfg_tensors_time', 'cnf_tensors_time', 'rfa_tensors_time',
+                  'rfa_tensors_incremental_time', 'rfa_tensors_implicit_time']
 iterations_num = 1
 
 
@@ -52,7 +53,8 @@ def benchmark_suite(request):
     grammars_path = os.path.join(suite_path, 'grammars')
     return {
         'suite': suite_name,
-        'graphs_paths': [os.path.join(graphs_path, graph_name) for graph_name in os.listdir(graphs_path)],
+        'graphs_paths': [os.path.join(graphs_path, graph_name) for graph_name in os.listdir(graphs_path)
+                         if not graph_name.endswith('.bin')],
         'grammars_paths': [os.path.join(grammars_path, grammar_name) for grammar_name in os.listdir(grammars_path)]
     }
 
@@ -67,7 +69,7 @@ def test_big_cfpq_data(benchmark_suite):
         graph_name = Path(graph_path).name
         grammar_name = Path(grammar_path).name
         print(f'Start processing graph <{graph_name}>, query grammar <{grammar_name}>')
-        graph = GraphWrapper.from_file(graph_path)
+        graph = GraphWrapper.from_file_with_binary_cache(graph_path)
 
         cnf_load_time, grammar = timeit(GrammarWrapper.from_file)(grammar_path)
         print(f'CNF loaded, {cnf_load_time} ms')
@@ -76,19 +78,33 @@ def test_big_cfpq_data(benchmark_suite):
 
         cnf_hellings_time, hellings_pairs = timeit(graph.cfpq_hellings)(grammar)
         print(f'Hellings done, {cnf_hellings_time} ms')
+        cnf_hellings_blocked_time, hellings_blocked_pairs = timeit(graph.cfpq_hellings)(grammar, blocked=True)
+        print(f'Hellings (blocked) done, {cnf_hellings_blocked_time} ms')
         cnf_matrices_time, matrices_pairs = timeit(graph.cfpq_matrices)(grammar)
         print(f'Matrices done, {cnf_matrices_time} ms')
+        cnf_matrices_delta_time, matrices_delta_pairs = timeit(graph.cfpq_matrices)(grammar, mode='delta')
+        print(f'Matrices (delta) done, {cnf_matrices_delta_time} ms')
         cfg_tensors_time, cfg_tensors_pairs = timeit(graph.cfpq_tensors)(grammar, from_wcnf=False)
         print(f'Tensors CFG done, {cfg_tensors_time} ms')
         cnf_tensors_time, cnf_tensors_pairs = timeit(graph.cfpq_tensors)(grammar, from_wcnf=True)
         print(f'Tensors CNF done, {cnf_tensors_time} ms')
         rfa_tensors_time, rfa_tensors_pairs = timeit(graph._cfpq_tensors_from_rfa)(rfa)
         print(f'Tensors RFA done, {rfa_tensors_time} ms')
-
+        rfa_tensors_incremental_time, rfa_tensors_incremental_pairs = \
+            timeit(graph._cfpq_tensors_from_rfa)(rfa, incremental=True)
+        print(f'Incremental tensors RFA done, {rfa_tensors_incremental_time} ms')
+        rfa_tensors_implicit_time, rfa_tensors_implicit_pairs = \
+            timeit(graph._cfpq_tensors_from_rfa)(rfa, implicit=True)
+        print(f'Implicit tensors RFA done, {rfa_tensors_implicit_time} ms')
+
+        assert hellings_pairs == hellings_blocked_pairs
         assert hellings_pairs == matrices_pairs
+        assert matrices_pairs == matrices_delta_pairs
         assert matrices_pairs == cfg_tensors_pairs
         assert cfg_tensors_pairs == cnf_tensors_pairs
         assert cnf_tensors_pairs == rfa_tensors_pairs
+        assert rfa_tensors_pairs == rfa_tensors_incremental_pairs
+        assert rfa_tensors_pairs == rfa_tensors_implicit_pairs
 
         with open(csv_path, 'a', newline='') as csvfile:
             writer = csv.DictWriter(csvfile, fieldnames=csv_fieldnames)
@@ -99,8 +115,12 @@ def test_big_cfpq_data(benchmark_suite):
                 'cnf_load_time': cnf_load_time,
                 'rfa_load_time': rfa_load_time,
                 'cnf_hellings_time': cnf_hellings_time,
+                'cnf_hellings_blocked_time': cnf_hellings_blocked_time,
                 'cnf_matrices_time': cnf_matrices_time,
+                'cnf_matrices_delta_time': cnf_matrices_delta_time,
                 'cfg_tensors_time': cfg_tensors_time,
                 'cnf_tensors_time': cnf_tensors_time,
-                'rfa_tensors_time': rfa_tensors_time
+                'rfa_tensors_time': rfa_tensors_time,
+                'rfa_tensors_incremental_time': rfa_tensors_incremental_time,
+                'rfa_tensors_implicit_time': rfa_tensors_implicit_time
             })
@@ -52,7 +52,7 @@ def benchmark_suite(request):
     regexes_names = os.listdir(regexes_path)
 
     return {
-        'graph': GraphWrapper.from_file(os.path.join(graph_path, f'{graph_name}.txt')),
+        'graph': GraphWrapper.from_file_with_binary_cache(os.path.join(graph_path, f'{graph_name}.txt')),
         'graph_name': graph_name,
         'regexes': [
             RegexGraphWrapper.from_regex_file(os.path.join(regexes_path, regex_name), is_python_regex=False)
@@ -1,6 +1,7 @@
 from itertools import chain
 
 import pytest
+from pyformlang.cfg import Terminal, Variable
 
 from wrappers import GrammarWrapper, GraphWrapper
 
@@ -42,6 +43,7 @@ def suite(request):
     return {
         "grammar_source_text": grammar,
         "graph": GraphWrapper.from_text(graph),
+        "graph_source_text": graph,
         "expected": set(expected),
         "algo": algo
     }
@@ -65,4 +67,159 @@ def test_cfpq_tensors_from_rfa(suite):
     graph, expected = suite['graph'], suite['expected']
     from wrappers import RFA
     rfa = RFA.from_text(suite['grammar_source_text'])
-    assert graph._cfpq_tensors_from_rfa(rfa) == expected
\ No newline at end of file
+    assert graph._cfpq_tensors_from_rfa(rfa) == expected
+
+
+def test_cfpq_matrices_delta(suite):
+    graph, expected = suite['graph'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    assert graph.cfpq_matrices(grammar, mode='delta') == expected
+
+
+def test_cfpq_tensors_incremental(suite):
+    graph, expected = suite['graph'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    assert graph.cfpq_tensors(grammar, incremental=True) == expected
+    from wrappers import RFA
+    rfa = RFA.from_text(suite['grammar_source_text'])
+    assert graph._cfpq_tensors_from_rfa(rfa, incremental=True) == expected
+
+
+def test_cfpq_with_cached_grammar(suite, tmp_path):
+    graph, expected = suite['graph'], suite['expected']
+    path_to_grammar = tmp_path / 'grammar.txt'
+    path_to_grammar.write_text('\n'.join(suite['grammar_source_text']))
+    from wrappers import RFA
+    for cache in [GrammarWrapper.cache, RFA.cache]:
+        cache.clear()
+        cache.cache_dir = str(tmp_path / 'cache')
+    try:
+        for _ in range(2):
+            assert graph.cfpq_matrices(GrammarWrapper.from_file(str(path_to_grammar))) == expected
+            assert graph._cfpq_tensors_from_rfa(RFA.from_file(str(path_to_grammar))) == expected
+            GrammarWrapper.cache.clear()
+            RFA.cache.clear()
+    finally:
+        GrammarWrapper.cache.cache_dir = None
+        RFA.cache.cache_dir = None
+
+
+def test_cfpq_witnesses(suite):
+    graph, expected = suite['graph'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    for pairs, extractor in [graph.cfpq_matrices(grammar, with_witnesses=True),
+                             graph.cfpq_tensors(grammar, with_witnesses=True)]:
+        assert pairs == expected
+        for node_from, node_to in pairs:
+            paths = list(extractor.get_paths(node_from, node_to, k=3))
+            assert 1 <= len(paths) <= 3
+            assert len(set(map(tuple, paths))) == len(paths)
+            assert len(paths[0]) == extractor.get_shortest_length(node_from, node_to)
+            for path in paths:
+                assert grammar.accepts([label for _, label, _ in path])
+                assert [v for v, _, _ in path[:1]] in ([], [node_from])
+                assert [u for _, _, u in path[-1:]] in ([], [node_to])
+                for (_, _, u), (v, _, _) in zip(path, path[1:]):
+                    assert u == v
+                for v, label, u in path:
+                    assert graph.label_to_bool_matrix[label].get(v, u, False)
+
+
+def test_cfpq_witnesses_unsupported_modes(suite):
+    graph = suite['graph']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    with pytest.raises(ValueError):
+        graph.cfpq_matrices(grammar, mode='delta', with_witnesses=True)
+    with pytest.raises(ValueError):
+        graph.cfpq_tensors(grammar, incremental=True, with_witnesses=True)
+
+
+@pytest.mark.parametrize('from_vertices, to_vertices', [
+    ({0}, None), (None, {3}), ({0, 1}, {2, 3}), ({2}, {2}), (set(), None)
+])
+def test_cfpq_from_to_vertices(suite, from_vertices, to_vertices):
+    graph, algo, expected = suite['graph'], suite['algo'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    solver = graph.__getattribute__(f'cfpq_{algo}')
+    assert solver(grammar, from_vertices=from_vertices, to_vertices=to_vertices) == set([
+        (i, j) for i, j in expected
+        if (from_vertices is None or i in from_vertices) and (to_vertices is None or j in to_vertices)
+    ])
+
+
+def test_cfpq_maintained(suite):
+    from wrappers import MaintainedCFPQ, Edge
+    expected = suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    edges = []
+    for line in suite['graph_source_text']:
+        node_from, label, node_to = line.split()
+        edges.append(Edge(int(node_from), int(node_to), label))
+    graph = GraphWrapper(edges[:len(edges) // 2])
+    query = MaintainedCFPQ(graph, grammar)
+    for edge in edges[len(edges) // 2:]:
+        graph.add_edges([edge])
+    assert query.get_reachable_pairs() == expected
+    graph.remove_edges(edges[:1])
+    assert query.get_reachable_pairs() == graph.cfpq_matrices(grammar)
+    graph.remove_edges(edges)
+    assert query.get_reachable_pairs() == graph.cfpq_matrices(grammar) == set()
+
+
+def test_cfpq_hellings_blocked(suite):
+    graph, expected = suite['graph'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    assert graph.cfpq_hellings(grammar, blocked=True) == expected
+
+
+def test_cfpq_tensors_implicit(suite):
+    graph, expected = suite['graph'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    assert graph.cfpq_tensors(grammar, implicit=True) == expected
+    assert graph.cfpq_tensors(grammar, from_wcnf=True, implicit=True) == expected
+    from wrappers import RFA
+    rfa = RFA.from_text(suite['grammar_source_text'])
+    assert graph._cfpq_tensors_from_rfa(rfa, implicit=True) == expected
+
+
+def test_cfpq_compacted(suite):
+    graph, expected = suite['graph'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    edges = [(i, label, j) for label, matrix in graph.label_to_bool_matrix.items() for i, j, _ in matrix]
+    compacted = GraphWrapper.from_text([f'v{i} {label} v{j}' for i, label, j in edges], compact=True).compact('bfs')
+    named = set([(f'v{i}', f'v{j}') for i, j in expected])
+    assert compacted.cfpq_matrices(grammar) == named
+    assert compacted.cfpq_hellings(grammar) == named
+    assert compacted.cfpq_tensors(grammar) == named
+    sources = [f'v{v}' for v in sorted(graph.vertices)[:2]]
+    assert compacted.cfpq_matrices(grammar, from_vertices=sources) == set([(i, j) for i, j in named if i in sources])
+    in_read_order = GraphWrapper.from_text(['z a b', 'b b a', 'q a z'], compact=True)
+    assert in_read_order.vertex_mapping.names == ['z', 'b', 'a', 'q']
+    pairs, extractor = compacted.cfpq_tensors(grammar, with_witnesses=True)
+    for node_from, node_to in pairs:
+        path = extractor.get_shortest_path(node_from, node_to)
+        assert len(path) == extractor.get_shortest_length(node_from, node_to)
+        assert [v for v, _, _ in path[:1]] in ([], [node_from])
+        assert [u for _, _, u in path[-1:]] in ([], [node_to])
+
+
+def test_cfpq_tensors_condensed(suite):
+    graph, expected = suite['graph'], suite['expected']
+    grammar = GrammarWrapper.from_text(suite['grammar_source_text'])
+    assert graph.cfpq_tensors(grammar, condensed=True) == expected
+    assert graph.cfpq_tensors(grammar, from_wcnf=True, condensed=True) == expected
+
+
+def test_grammar_pruned():
+    grammar = GrammarWrapper.from_text(['S a S b', 'S a A b', 'S a b', 'S e', 'A a S b', 'A a A b', 'A a b', 'A e',
+                                        'S C', 'C c D', 'D d D', 'B b'])
+    pruned = grammar.pruned()
+    assert not {Variable('A'), Variable('B'), Variable('D')} & pruned.cnf.variables
+    assert len(pruned.cnf.variables) < len(grammar.cnf.variables)
+    assert pruned.cnf.start_symbol == grammar.cnf.start_symbol
+    labeled = grammar.pruned(['a', 'b'])
+    assert Terminal('e') not in labeled.cnf.terminals
+    for word in ['ab', 'aabb', 'aaabbb', 'e', 'aab', 'ba', 'cd']:
+        assert pruned.accepts(word) == grammar.accepts(word)
+        assert labeled.accepts(word) == (grammar.accepts(word) and set(word) <= {'a', 'b'})
+    assert grammar.pruned(['b', 'a', 'x']) is labeled
@@ -34,3 +34,9 @@ def suite(request):
 def test_cyk(suite):
     cfg, word, expected = suite['grammar'], suite['word'], suite['expected']
     assert cfg.accepts(word) == expected
+
+
+def test_cyk_batch():
+    cfg = GrammarWrapper.from_text(grammars[0])
+    words = ['aabbab', 'aab', '', 'ababa', 'abaaabbb']
+    assert cfg.accepts_batch(words) == [True, False, True, False, True]
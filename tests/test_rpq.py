@@ -89,6 +89,25 @@ def test_prepared_rpq(suite):
     assert suite['expected_from_to'] == solve_rpq(graph, constraint, suite['query_from_to'])
 
 
+def test_prepared_rpq_by_bfs(suite):
+    graph: GraphWrapper = suite['graph']
+    constraint: RegexGraphWrapper = suite['constraint']
+    for query_name in ['all', 'from', 'from_to']:
+        query = dict(suite[f'query_{query_name}'], strategy='bfs')
+        assert suite[f'expected_{query_name}'] == solve_rpq(graph, constraint, query)
+
+
+def test_prepared_rpq_as_arrays(suite):
+    graph: GraphWrapper = suite['graph']
+    constraint: RegexGraphWrapper = suite['constraint']
+    for query_name in ['all', 'from', 'from_to']:
+        for strategy in ['tensor', 'bfs']:
+            query = dict(suite[f'query_{query_name}'], strategy=strategy)
+            rows, cols = solve_rpq(graph, constraint, query, as_arrays=True)
+            assert len(rows) == len(suite[f'expected_{query_name}'])
+            assert set(zip(rows.tolist(), cols.tolist())) == suite[f'expected_{query_name}']
+
+
 def test_random_rpq(random_suite):
     graph: GraphWrapper = random_suite['graph']
     constraint: RegexGraphWrapper = random_suite['constraint']
@@ -99,3 +118,182 @@ def test_random_rpq(random_suite):
             regex_i, regex_j = i // graph.vertices_num, j // graph.vertices_num
             assert graph.label_to_bool_matrix[label][graph_i, graph_j] == 1
             assert constraint.label_to_bool_matrix[label][regex_i, regex_j] == 1
+
+
+def test_closures_agree(random_suite):
+    graph: GraphWrapper = random_suite['graph']
+    constraint: RegexGraphWrapper = random_suite['constraint']
+    intersection: GraphWrapper = constraint.kronecker_product(graph)
+    sq_closure = intersection.build_closure_by_squaring()
+    mult_closure = intersection.build_closure_by_adj_matrix_multiplication()
+    from_closure = intersection.build_closure_from(range(intersection.vertices_num))
+    assert sq_closure.iseq(mult_closure)
+    assert sq_closure.iseq(from_closure)
+    condensed_closure = intersection.build_closure_by_condensation()
+    assert set(condensed_closure.iter_pairs()) == set((i, j) for i, j, _ in sq_closure)
+    sources = set(intersection.start_states)
+    partial_closure = intersection.build_closure_from(sources)
+    assert set((i, j) for i, j, _ in partial_closure) == set((i, j) for i, j, _ in sq_closure if i in sources)
+
+
+def test_random_rpq_by_bfs(random_suite):
+    graph: GraphWrapper = random_suite['graph']
+    constraint: RegexGraphWrapper = random_suite['constraint']
+    sources = random.sample(range(graph.vertices_num), min(5, graph.vertices_num))
+    for query in [{'reachability_between_all': True}, {'reachability_from_set': sources}]:
+        assert solve_rpq(graph, constraint, query) == solve_rpq(graph, constraint, dict(query, strategy='bfs'))
+
+
+def test_graph_loading_by_chunks(random_suite, tmp_path):
+    graph: GraphWrapper = random_suite['graph']
+    path_to_graph = tmp_path / 'graph.txt'
+    with open(path_to_graph, 'w') as file:
+        for label, matrix in graph.label_to_bool_matrix.items():
+            for i, j, _ in matrix:
+                file.write(f'{i} {label} {j}\n')
+    loaded_graph = GraphWrapper.from_file(str(path_to_graph), chunk_size=64)
+    assert loaded_graph.vertices == graph.vertices
+    assert loaded_graph.label_to_bool_matrix.keys() == graph.label_to_bool_matrix.keys()
+    for label, matrix in graph.label_to_bool_matrix.items():
+        assert loaded_graph.label_to_bool_matrix[label].iseq(matrix)
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_binary_graph_format(suite, tmp_path, use_mmap):
+    graph: GraphWrapper = suite['expected_intersection']
+    path_to_binary = str(tmp_path / 'graph.bin')
+    graph.save_binary(path_to_binary)
+    loaded_graph = GraphWrapper.load_binary(path_to_binary, use_mmap=use_mmap)
+    assert loaded_graph.matrix_size == graph.matrix_size
+    assert loaded_graph.vertices == graph.vertices
+    assert loaded_graph.start_states == set(graph.start_states)
+    assert loaded_graph.final_states == set(graph.final_states)
+    assert loaded_graph.label_to_bool_matrix.keys() == graph.label_to_bool_matrix.keys()
+    for label, matrix in graph.label_to_bool_matrix.items():
+        assert loaded_graph.label_to_bool_matrix[label].iseq(matrix)
+    assert loaded_graph.vertex_mapping is None
+    compacted = graph.compact('degree')
+    compacted.save_binary(path_to_binary)
+    assert GraphWrapper.load_binary(path_to_binary, use_mmap=use_mmap).vertex_mapping.names == \
+        compacted.vertex_mapping.names
+    constraint: RegexGraphWrapper = suite['constraint']
+    constraint.save_binary(path_to_binary)
+    loaded_constraint = GraphWrapper.load_binary(path_to_binary, use_mmap=use_mmap)
+    for label, matrix in constraint.label_to_bool_matrix.items():
+        assert loaded_constraint.label_to_bool_matrix[str(label)].iseq(matrix)
+
+
+@pytest.mark.parametrize('regex', ['a*b*', 'a(b|c)*(c|d)', '(d|b|c)aa*'])
+def test_regex_cache(regex, tmp_path):
+    RegexGraphWrapper.cache.clear()
+    RegexGraphWrapper.cache.cache_dir = str(tmp_path)
+    try:
+        compiled = RegexGraphWrapper.from_regex(regex, use_cache=False)
+        from_memory = RegexGraphWrapper.from_regex(regex)
+        RegexGraphWrapper.cache.clear()
+        from_disk = RegexGraphWrapper.from_regex(f' {regex}\n')
+    finally:
+        RegexGraphWrapper.cache.cache_dir = None
+    for cached in [from_memory, from_disk]:
+        assert cached.start_states == compiled.start_states
+        assert cached.final_states == compiled.final_states
+        assert cached.label_to_bool_matrix.keys() == compiled.label_to_bool_matrix.keys()
+        for label, matrix in compiled.label_to_bool_matrix.items():
+            assert cached.label_to_bool_matrix[label].iseq(matrix)
+        assert cached.dfa.is_equivalent_to(compiled.dfa)
+        assert set([cached.dfa_state_to_idx[state] for state in cached.dfa.start_states]) == compiled.start_states
+
+
+def test_prepared_rpq_maintained(suite):
+    from wrappers import MaintainedRPQ
+    graph: GraphWrapper = suite['graph']
+    constraint: RegexGraphWrapper = suite['constraint']
+    edges = [Edge(node_from=i, node_to=j, label=label)
+             for label, matrix in graph.label_to_bool_matrix.items() for i, j, _ in matrix]
+    dynamic_graph = GraphWrapper(edges[:len(edges) // 2])
+    queries = {name: MaintainedRPQ(dynamic_graph, constraint, suite[f'query_{name}'])
+               for name in ['all', 'from', 'from_to']}
+    for edge in edges[len(edges) // 2:]:
+        dynamic_graph.add_edges([edge])
+    for name, query in queries.items():
+        assert query.get_reachable_pairs() == suite[f'expected_{name}']
+    dynamic_graph.remove_edges(edges[-1:])
+    for name, query in queries.items():
+        assert query.get_reachable_pairs() == solve_rpq(dynamic_graph, constraint, suite[f'query_{name}'])
+
+
+def test_rpq_batch(tmp_path):
+    from solve_batch import solve_rpq_batch
+    for suite_name in rpq_test_suites:
+        test_path = os.path.join(rpq_data_path, suite_name)
+        path_to_graph = tmp_path / f'{suite_name}.txt'
+        with open(os.path.join(test_path, 'graph.txt'), 'r') as file:
+            path_to_graph.write_text(file.read())
+        with open(os.path.join(test_path, 'query_all.json'), 'r') as file:
+            query = json.load(file)
+        with open(os.path.join(test_path, 'expected_all.txt'), 'r') as file:
+            expected = set([tuple(map(int, line.split())) for line in file.readlines()])
+        paths_to_regexes = [os.path.join(test_path, 'regex.txt')] * 3
+        results = list(solve_rpq_batch(str(path_to_graph), paths_to_regexes, query, processes=2))
+        assert len(results) == 3
+        for result in results:
+            rows, cols = result.reachable_pairs
+            assert set(zip(rows.tolist(), cols.tolist())) == expected
+
+
+def test_kronecker_product_drop_unreachable(suite):
+    graph: GraphWrapper = suite['graph']
+    constraint: RegexGraphWrapper = suite['constraint']
+    full_intersection = constraint.kronecker_product(graph)
+    intersection = constraint.kronecker_product(graph, drop_unreachable=True)
+    assert intersection.matrix_size == full_intersection.matrix_size
+    assert sum(intersection.edges_counter.values()) <= sum(full_intersection.edges_counter.values())
+    rows, cols = intersection.get_reachable_pairs(intersection.start_states, intersection.final_states,
+                                                  as_arrays=True)
+    step = graph.vertices_num
+    assert set(zip((rows % step).tolist(), (cols % step).tolist())) == suite['expected_all']
+
+
+def test_prepared_rpq_exists_and_count(suite):
+    graph: GraphWrapper = suite['graph']
+    constraint: RegexGraphWrapper = suite['constraint']
+    for query_name in ['all', 'from', 'from_to']:
+        for strategy in ['tensor', 'bfs']:
+            query = dict(suite[f'query_{query_name}'], strategy=strategy)
+            expected = suite[f'expected_{query_name}']
+            assert solve_rpq(graph, constraint, dict(query, exists=True)) == bool(expected)
+            assert solve_rpq(graph, constraint, dict(query, count_only=True)) == len(expected)
+
+
+def test_prepared_rpq_condensed_closure(suite):
+    graph: GraphWrapper = suite['graph']
+    constraint: RegexGraphWrapper = suite['constraint']
+    for query_name in ['all', 'from', 'from_to']:
+        query = dict(suite[f'query_{query_name}'], closure='condensed')
+        assert solve_rpq(graph, constraint, query) == suite[f'expected_{query_name}']
+    intersection = constraint.kronecker_product(graph)
+    closure = intersection.build_closure_by_condensation()
+    expected = set((i, j) for i, j, _ in intersection.build_closure_by_squaring())
+    assert set(closure.iter_pairs()) == expected
+    assert closure.count_pairs() == len(expected)
+    assert all(closure.is_reachable(i, j) for i, j in expected)
+
+
+@pytest.mark.parametrize('order', ['identity', 'bfs', 'degree'])
+def test_prepared_rpq_compacted(suite, order):
+    graph: GraphWrapper = suite['graph']
+    constraint: RegexGraphWrapper = suite['constraint']
+    edges = [(i, label, j) for label, matrix in graph.label_to_bool_matrix.items() for i, j, _ in matrix]
+    for name in [lambda v: v * 1000, lambda v: f'v{v}']:
+        compacted = GraphWrapper.from_text([f'{name(i)} {label} {name(j)}' for i, label, j in edges], compact=True)
+        compacted = compacted.compact(order)
+        assert compacted.matrix_size == len(graph.vertices)
+        for query_name in ['all', 'from', 'from_to']:
+            query = dict(suite[f'query_{query_name}'])
+            for key in ['reachability_from_set', 'reachability_to_set']:
+                if key in query:
+                    query[key] = [name(v) for v in query[key]]
+            expected = set([(name(i), name(j)) for i, j in suite[f'expected_{query_name}']])
+            assert solve_rpq(compacted, constraint, query) == expected
+            rows, cols = solve_rpq(compacted, constraint, query, as_arrays=True)
+            assert set(zip(rows.tolist(), cols.tolist())) == expected
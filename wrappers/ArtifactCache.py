@@ -0,0 +1,52 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+from typing import Any, Optional, Union
+
+
+class ArtifactCache:
+    def __init__(self, capacity: int = 128, cache_dir: Optional[str] = None):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self._artifacts: 'OrderedDict[str, Any]' = OrderedDict()
+
+    @staticmethod
+    def get_key(*parts: Union[str, bytes]) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(part if isinstance(part, bytes) else part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        artifact = self._artifacts.get(key)
+        if artifact is None and self.cache_dir is not None:
+            path_to_file = os.path.join(self.cache_dir, f'{key}.pickle')
+            if os.path.exists(path_to_file):
+                with open(path_to_file, 'rb') as file:
+                    artifact = pickle.load(file)
+        if artifact is not None:
+            self._remember(key, artifact)
+        return artifact
+
+    def put(self, key: str, artifact: Any):
+        self._remember(key, artifact)
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path_to_file = os.path.join(self.cache_dir, f'{key}.pickle')
+            with open(f'{path_to_file}.tmp', 'wb') as file:
+                pickle.dump(artifact, file)
+            os.replace(f'{path_to_file}.tmp', path_to_file)
+
+    def clear(self):
+        self._artifacts.clear()
+
+    def __len__(self):
+        return len(self._artifacts)
+
+    def _remember(self, key: str, artifact: Any):
+        self._artifacts[key] = artifact
+        self._artifacts.move_to_end(key)
+        while len(self._artifacts) > self.capacity:
+            self._artifacts.popitem(last=False)
@@ -1,18 +1,28 @@
-from typing import List, Dict
+from typing import List, Dict, Set, Tuple, Any, Iterable, Optional, FrozenSet
 
 from pyformlang.cfg import Variable, Terminal, CFG, Production
 from pyformlang.finite_automaton import State
 from pyformlang.regular_expression import Regex
 
+from wrappers.ArtifactCache import ArtifactCache
+
 
 class GrammarWrapper:
     __var_state_counter = 0
+    cache = ArtifactCache()
 
-    def __init__(self, cfg: CFG):
+    def __init__(self, cfg: CFG, cnf: Optional[CFG] = None):
         self.cfg = cfg
         self.generate_epsilon = cfg.generate_epsilon()
-        self.cnf = cfg.to_normal_form()
+        self.cnf = cfg.to_normal_form() if cnf is None else cnf
         self.wcnf = self.get_weak_cnf()
+        self.heads_by_body_pair: Dict[Tuple[Variable, Variable], Set[Variable]] = {}
+        self.heads_by_terminal: Dict[Terminal, Set[Variable]] = {}
+        self.pairs_by_left_var: Dict[Variable, List[Tuple[Variable, Set[Variable]]]] = {}
+        self.pairs_by_right_var: Dict[Variable, List[Tuple[Variable, Set[Variable]]]] = {}
+        self._build_production_indexes()
+        self._compile_cyk()
+        self.pruned_by_terminals: Dict[Optional[FrozenSet[Terminal]], 'GrammarWrapper'] = {}
 
     @classmethod
     def from_text(cls, text: List[str], use_python_regexes_if_necessary=False, variables=None):
@@ -58,9 +68,21 @@ class GrammarWrapper:
         return cls(cfg)
 
     @classmethod
-    def from_file(cls, path_to_file: str, use_python_regexes_if_necessary=False, variables=None):
+    def from_file(cls, path_to_file: str, use_python_regexes_if_necessary=False, variables=None, use_cache=True):
         with open(path_to_file, 'r') as file:
-            return cls.from_text(file.readlines(), use_python_regexes_if_necessary, variables)
+            text = file.read()
+        if not use_cache:
+            return cls.from_text(text.splitlines(), use_python_regexes_if_necessary, variables)
+        key = ArtifactCache.get_key('grammar', text, str(use_python_regexes_if_necessary),
+                                    ' '.join(sorted(variables or [])))
+        compiled = cls.cache.get(key)
+        if compiled is not None:
+            instance = cls.__new__(cls)
+            instance.__dict__.update(compiled)
+            return instance
+        grammar = cls.from_text(text.splitlines(), use_python_regexes_if_necessary, variables)
+        cls.cache.put(key, dict(grammar.__dict__))
+        return grammar
 
     @classmethod
     def _create_cfg_from_regex(cls, head: Variable, regex: Regex, variables=None) -> CFG:
@@ -96,6 +118,84 @@ class GrammarWrapper:
             return CFG(vars, terms, head, {Production(head, [])})
         return CFG(vars, terms, head, productions)
 
+    def _build_production_indexes(self):
+        for prod in self.cnf.productions:
+            if len(prod.body) == 2:
+                self.heads_by_body_pair.setdefault((prod.body[0], prod.body[1]), set()).add(prod.head)
+            elif len(prod.body) == 1:
+                self.heads_by_terminal.setdefault(prod.body[0], set()).add(prod.head)
+        for (left, right), heads in self.heads_by_body_pair.items():
+            self.pairs_by_left_var.setdefault(left, []).append((right, heads))
+            self.pairs_by_right_var.setdefault(right, []).append((left, heads))
+
+    def pruned(self, labels: Optional[Iterable[Any]] = None):
+        # Only the labels the grammar uses matter, so graphs with the same such labels share the pruned grammar
+        terminals = None if labels is None else frozenset([Terminal(label) for label in labels]) & self.cnf.terminals
+        if terminals not in self.pruned_by_terminals:
+            self.pruned_by_terminals[terminals] = self._prune(terminals)
+        return self.pruned_by_terminals[terminals]
+
+    def _prune(self, terminals: Optional[FrozenSet[Terminal]]):
+        start_symbol = self.cnf.start_symbol
+        productions = set(self.cnf.productions)
+        if terminals is not None:
+            productions = set([prod for prod in productions if len(prod.body) != 1 or prod.body[0] in terminals])
+        productive: Set[Variable] = set()
+        has_changed = True
+        while has_changed:
+            has_changed = False
+            for prod in productions:
+                if prod.head not in productive and all([isinstance(symbol, Terminal) or symbol in productive
+                                                        for symbol in prod.body]):
+                    productive.add(prod.head)
+                    has_changed = True
+        productions = set([prod for prod in productions
+                           if all([isinstance(symbol, Terminal) or symbol in productive for symbol in prod.body])])
+        bodies_by_head: Dict[Variable, List[List[Any]]] = {}
+        for prod in productions:
+            bodies_by_head.setdefault(prod.head, []).append(prod.body)
+        reachable, stack = {start_symbol}, [start_symbol]
+        while stack:
+            for body in bodies_by_head.get(stack.pop(), ()):
+                for symbol in body:
+                    if isinstance(symbol, Variable) and symbol not in reachable:
+                        reachable.add(symbol)
+                        stack.append(symbol)
+        productions = self._merge_equivalent_variables(set([prod for prod in productions if prod.head in reachable]))
+        variables = set([prod.head for prod in productions]) | {start_symbol}
+        terminals = set([symbol for prod in productions for symbol in prod.body if isinstance(symbol, Terminal)])
+        return GrammarWrapper(self.cfg, CFG(variables, terminals, start_symbol, productions))
+
+    def _merge_equivalent_variables(self, productions: Set[Production]) -> Set[Production]:
+        # Coarsest partition of variables whose bodies coincide up to the partition; the start symbol is kept apart
+        # when it also derives the empty word, which is not present in its CNF productions
+        start_symbol = self.cnf.start_symbol
+        bodies_by_head: Dict[Variable, List[List[Any]]] = {}
+        for prod in productions:
+            bodies_by_head.setdefault(prod.head, []).append(prod.body)
+        block_by_var = {var: int(var == start_symbol and self.generate_epsilon) for var in bodies_by_head}
+        blocks_num = len(set(block_by_var.values()))
+        while True:
+            block_by_signature: Dict[Any, int] = {}
+            new_block_by_var: Dict[Variable, int] = {}
+            for var, bodies in bodies_by_head.items():
+                signature = (block_by_var[var], frozenset([tuple([block_by_var.get(symbol, symbol) for symbol in body])
+                                                           for body in bodies]))
+                new_block_by_var[var] = block_by_signature.setdefault(signature, len(block_by_signature))
+            block_by_var = new_block_by_var
+            if len(block_by_signature) == blocks_num:
+                break
+            blocks_num = len(block_by_signature)
+        vars_by_block: Dict[int, List[Variable]] = {}
+        for var, block in block_by_var.items():
+            vars_by_block.setdefault(block, []).append(var)
+        replacement: Dict[Variable, Variable] = {}
+        for variables in vars_by_block.values():
+            kept = start_symbol if start_symbol in variables else min(variables, key=lambda var: str(var.value))
+            replacement.update({var: kept for var in variables})
+        return set([Production(replacement[prod.head], [replacement.get(symbol, symbol) for symbol in prod.body])
+                    for prod in productions])
+
     def get_weak_cnf(self) -> CFG:
         wcnf = self.cnf
         if self.generate_epsilon:
@@ -108,26 +208,73 @@ class GrammarWrapper:
             return CFG(new_variables, wcnf.terminals, new_start_symbol, new_productions)
         return wcnf
 
+    def _compile_cyk(self):
+        self.cyk_var_ids: Dict[Variable, int] = {var: idx for idx, var in enumerate(self.cnf.variables)}
+        self.cyk_heads_by_terminal: Dict[Any, int] = {}
+        for term, heads in self.heads_by_terminal.items():
+            self.cyk_heads_by_terminal[term.value] = self._get_vars_bitset(heads)
+        self.cyk_pairs_by_left_id: Dict[int, List[Tuple[int, int]]] = {}
+        for (left, right), heads in self.heads_by_body_pair.items():
+            self.cyk_pairs_by_left_id.setdefault(self.cyk_var_ids[left], []).append(
+                (self.cyk_var_ids[right], self._get_vars_bitset(heads))
+            )
+
+    def _get_vars_bitset(self, variables) -> int:
+        bitset = 0
+        for var in variables:
+            bitset |= 1 << self.cyk_var_ids[var]
+        return bitset
+
     def accepts(self, word) -> bool:
-        size = len(word)
-        if size == 0:
-            return self.cfg.generate_epsilon()
-        cnf = self.cfg.to_normal_form()
-        inference_matrix = [[set() for _ in range(size)] for _ in range(size)]
-        for i in range(size):
-            term = Terminal(word[i])
-            for prod in cnf.productions:
-                if len(prod.body) == 1 and prod.body[0] == term:
-                    inference_matrix[i][i].add(prod.head)
-        for length in range(1, size):
-            for pos in range(size):
-                if pos + length >= size:
-                    break
-                for split in range(length):
-                    first_part = inference_matrix[pos][pos + split]
-                    second_part = inference_matrix[pos + split + 1][pos + length]
-                    for prod in cnf.productions:
-                        if len(prod.body) == 2:
-                            if prod.body[0] in first_part and prod.body[1] in second_part:
-                                inference_matrix[pos][pos + length].add(prod.head)
-        return cnf.start_symbol in inference_matrix[0][size - 1]
+        if len(word) == 0:
+            return self.generate_epsilon
+        if self.cnf.start_symbol not in self.cyk_var_ids:
+            return False
+        columns: List[List[int]] = []
+        for terminal in word:
+            self._add_cyk_column(columns, terminal)
+        return bool(columns[-1][0] >> self.cyk_var_ids[self.cnf.start_symbol] & 1)
+
+    def accepts_batch(self, words) -> List[bool]:
+        words = [tuple(word) for word in words]
+        if self.cnf.start_symbol not in self.cyk_var_ids:
+            return [len(word) == 0 and self.generate_epsilon for word in words]
+        start_bit = self.cyk_var_ids[self.cnf.start_symbol]
+        # Column j of the CYK table depends only on the first j + 1 letters, so in sorted order
+        # each word reuses the columns of its common prefix with the previous one
+        accepted: Dict[Tuple, bool] = {(): self.generate_epsilon}
+        columns: List[List[int]] = []
+        previous: Tuple = ()
+        for word in sorted(set(words)):
+            if not word:
+                continue
+            common = 0
+            while common < min(len(word), len(previous)) and word[common] == previous[common]:
+                common += 1
+            del columns[common:]
+            for terminal in word[common:]:
+                self._add_cyk_column(columns, terminal)
+            accepted[word] = bool(columns[-1][0] >> start_bit & 1)
+            previous = word
+        return [accepted[word] for word in words]
+
+    def _add_cyk_column(self, columns: List[List[int]], terminal):
+        # columns[end][start] holds the variables deriving word[start..end]
+        end = len(columns)
+        column = [0] * (end + 1)
+        column[end] = self.cyk_heads_by_terminal.get(terminal, 0)
+        for start in range(end - 1, -1, -1):
+            cell = 0
+            for split in range(start, end):
+                first_part = columns[split][start]
+                second_part = column[split + 1]
+                if not first_part or not second_part:
+                    continue
+                while first_part:
+                    lowest_bit = first_part & -first_part
+                    for right_id, heads in self.cyk_pairs_by_left_id.get(lowest_bit.bit_length() - 1, ()):
+                        if second_part >> right_id & 1:
+                            cell |= heads
+                    first_part ^= lowest_bit
+            column[start] = cell
+        columns.append(column)
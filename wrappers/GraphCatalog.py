@@ -0,0 +1,75 @@
+import logging
+import os
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from wrappers.GraphWrapper import GraphWrapper
+
+
+class GraphCatalog:
+    def __init__(self, path_to_db: Optional[str] = None, max_nvals: int = 1 << 26):
+        self.path_to_db = path_to_db
+        self.max_nvals = max_nvals
+        self.cached_nvals = 0
+        self.hits = 0
+        self.misses = 0
+        # Real path -> (file version, graph, nvals), least recently used first
+        self.__cache: 'OrderedDict[str, Tuple[Tuple[int, int], GraphWrapper, int]]' = OrderedDict()
+
+    def names(self) -> List[str]:
+        if self.path_to_db is None or not os.path.isdir(self.path_to_db):
+            return []
+        return sorted(entry.name[:-len('.txt')] if entry.name.endswith('.txt') else entry.name
+                      for entry in os.scandir(self.path_to_db)
+                      if entry.is_file() and not entry.name.endswith('.bin'))
+
+    def resolve(self, name: str) -> str:
+        path_to_graph = name if self.path_to_db is None else os.path.join(self.path_to_db, name)
+        if not os.path.exists(path_to_graph) and os.path.exists(f'{path_to_graph}.txt'):
+            return f'{path_to_graph}.txt'
+        return path_to_graph
+
+    def get(self, name: str) -> GraphWrapper:
+        return self.load(self.resolve(name))
+
+    def load(self, path_to_graph: str) -> GraphWrapper:
+        # Cached graphs are shared between callers and must not be modified in place
+        key = os.path.realpath(path_to_graph)
+        stat = os.stat(key)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if key in self.__cache:
+            cached_version, graph, nvals = self.__cache[key]
+            if cached_version == version:
+                self.hits += 1
+                self.__cache.move_to_end(key)
+                return graph
+            self.__evict(key)
+        self.misses += 1
+        graph = GraphWrapper.from_file(key)
+        nvals = sum([matrix.nvals for matrix in graph.label_to_bool_matrix.values()])
+        self.__cache[key] = (version, graph, nvals)
+        self.cached_nvals += nvals
+        # The graph just loaded stays cached even if it alone exceeds the limit
+        while self.cached_nvals > self.max_nvals and len(self.__cache) > 1:
+            self.__evict(next(iter(self.__cache)))
+        return graph
+
+    def invalidate(self, name: Optional[str] = None):
+        if name is None:
+            for key in list(self.__cache):
+                self.__evict(key)
+        else:
+            key = os.path.realpath(self.resolve(name))
+            if key in self.__cache:
+                self.__evict(key)
+
+    def __evict(self, key: str):
+        _, _, nvals = self.__cache.pop(key)
+        self.cached_nvals -= nvals
+        logging.info(f'Evicted {key} ({nvals} edges) from the graph catalog')
+
+    def __contains__(self, name: str) -> bool:
+        return os.path.realpath(self.resolve(name)) in self.__cache
+
+    def __len__(self) -> int:
+        return len(self.__cache)
@@ -1,19 +1,69 @@
+import inspect
+import json
+import logging
+import os
+import struct
+import time
+import warnings
+from array import array
 from collections import deque
+from collections.abc import Set as AbstractSet
 from dataclasses import dataclass
-from itertools import chain
-from typing import Tuple, Dict, List, Set, Optional, Any
+from functools import wraps
+from typing import Tuple, Dict, List, Set, Optional, Any, Iterable, Callable, Iterator
 
-from pyformlang.cfg import Terminal, Variable
+import numpy as np
+from pyformlang.cfg import Terminal, Variable, Production
 from pyformlang.finite_automaton import State, Symbol, NondeterministicFiniteAutomaton
 from pygraphblas import Matrix, semiring
+from pygraphblas import lib, ffi
 from pygraphblas import binaryop
+from pygraphblas import descriptor
 from pygraphblas import types
 
 from wrappers import GrammarWrapper
+from wrappers.PathExtractor import PathExtractor, MappedPathExtractor
+from wrappers.VertexMapping import VertexMapping
 
 Indices = List[int]
 
 
+def _bool_matrix_from_arrays(I: np.ndarray, J: np.ndarray, nrows: int, ncols: Optional[int] = None) -> Matrix:
+    # Tuples go to GrB_Matrix_build straight from the int64 buffers, no Python ints are created on the way
+    matrix = Matrix.sparse(types.BOOL, nrows, nrows if ncols is None else ncols)
+    I = np.ascontiguousarray(I, dtype=np.int64).view(np.uint64)
+    J = np.ascontiguousarray(J, dtype=np.int64).view(np.uint64)
+    if I.size:
+        values = np.ones(I.size, dtype=np.bool_)
+        info = lib.GrB_Matrix_build_BOOL(matrix._matrix[0], ffi.from_buffer('GrB_Index[]', I),
+                                         ffi.from_buffer('GrB_Index[]', J), ffi.from_buffer('bool[]', values),
+                                         I.size, lib.GrB_LOR)
+        if info != lib.GrB_SUCCESS:
+            raise RuntimeError(f'GrB_Matrix_build failed with code {info}')
+    return matrix
+
+
+def _with_vertex_mapping(method):
+    # Vertex sets are passed and pairs are returned in external ids when the graph is compacted
+    signature = inspect.signature(method)
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        mapping = self.vertex_mapping
+        if mapping is None:
+            return method(self, *args, **kwargs)
+        bound = signature.bind(self, *args, **kwargs)
+        for key in ('from_vertices', 'to_vertices'):
+            if bound.arguments.get(key) is not None:
+                bound.arguments[key] = mapping.to_internal(bound.arguments[key])
+        result = method(*bound.args, **bound.kwargs)
+        if isinstance(result, tuple):
+            pairs, extractor = result
+            return mapping.to_external_pairs(pairs), MappedPathExtractor(extractor, mapping)
+        return mapping.to_external_pairs(result)
+    return wrapper
+
+
 @dataclass(eq=True, frozen=True)
 class Edge:
     node_from: int
@@ -21,51 +71,398 @@ class Edge:
     label: Any
 
 
+class ProductStates:
+    def __init__(self, outer: Iterable[int], step: int, inner: Optional[Iterable[int]] = None):
+        self.outer = np.unique(np.fromiter(outer, dtype=np.int64))
+        self.step = step
+        self.inner = None if inner is None else np.unique(np.fromiter(
+            [idx for idx in inner if 0 <= idx < step], dtype=np.int64
+        ))
+        self._outer_set = set(self.outer.tolist())
+        self._inner_set = None if self.inner is None else set(self.inner.tolist())
+
+    def restrict(self, inner: Iterable[int]):
+        inner = set(inner)
+        if self._inner_set is not None:
+            inner &= self._inner_set
+        return ProductStates(self.outer, self.step, inner)
+
+    def to_array(self) -> np.ndarray:
+        inner = np.arange(self.step, dtype=np.int64) if self.inner is None else self.inner
+        return (self.outer[:, None] * self.step + inner[None, :]).ravel()
+
+    def __contains__(self, idx) -> bool:
+        outer_idx, inner_idx = divmod(idx, self.step)
+        if outer_idx not in self._outer_set:
+            return False
+        return 0 <= inner_idx < self.step if self._inner_set is None else inner_idx in self._inner_set
+
+    def __iter__(self):
+        return iter(self.to_array().tolist())
+
+    def __len__(self):
+        return len(self.outer) * (self.step if self.inner is None else len(self.inner))
+
+
+class VertexSet(AbstractSet):
+    def __init__(self, values: Iterable[int] = ()):
+        # Sorted unique indices; the array may be a read-only view of a memory-mapped file
+        if isinstance(values, np.ndarray):
+            self.array = values
+        else:
+            self.array = np.unique(np.fromiter(values, dtype=np.int64))
+
+    @classmethod
+    def from_bitmap(cls, bitmap: np.ndarray):
+        return cls(np.flatnonzero(bitmap).astype(np.int64))
+
+    def update(self, values: Iterable[int]):
+        values = values if isinstance(values, np.ndarray) else np.fromiter(values, dtype=np.int64)
+        self.array = np.union1d(self.array, values).astype(np.int64)
+
+    def difference_update(self, values: Iterable[int]):
+        values = values if isinstance(values, np.ndarray) else np.fromiter(values, dtype=np.int64)
+        self.array = np.setdiff1d(self.array, values).astype(np.int64)
+
+    def to_array(self) -> np.ndarray:
+        return self.array
+
+    def __contains__(self, idx) -> bool:
+        position = int(np.searchsorted(self.array, idx))
+        return position < self.array.size and self.array[position] == idx
+
+    def __iter__(self):
+        return iter(self.array.tolist())
+
+    def __len__(self):
+        return int(self.array.size)
+
+
+def _as_index_array(indices: Iterable[int]) -> np.ndarray:
+    if isinstance(indices, (VertexSet, ProductStates)):
+        return indices.to_array()
+    return np.fromiter(sorted(indices), dtype=np.int64)
+
+
+class CondensedClosure:
+    def __init__(self, component: np.ndarray, closure: Matrix):
+        # Vertex u reaches v iff closure has the entry (component[u], component[v])
+        self.component = component
+        self.closure = closure
+        self._members = np.argsort(component, kind='stable')
+        self._offsets = np.searchsorted(component[self._members], np.arange(closure.nrows + 1))
+
+    @property
+    def components_num(self) -> int:
+        return self.closure.nrows
+
+    def members(self, component: int) -> np.ndarray:
+        return self._members[self._offsets[component]:self._offsets[component + 1]]
+
+    def is_reachable(self, node_from: int, node_to: int) -> bool:
+        return bool(self.closure.get(int(self.component[node_from]), int(self.component[node_to]), False))
+
+    def iter_blocks(self, from_indices: Optional[Iterable[int]] = None,
+                    to_indices: Optional[Iterable[int]] = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        # Every source of a block reaches every target of it, blocks never share a pair
+        from_mask, to_mask = self._get_mask(from_indices), self._get_mask(to_indices)
+        I, J, _ = self.closure.to_lists()
+        I, J = np.asarray(I, dtype=np.int64), np.asarray(J, dtype=np.int64)
+        order = np.argsort(I, kind='stable')
+        I, J = I[order], J[order]
+        bounds = np.flatnonzero(np.diff(I)) + 1
+        for rows, cols in zip(np.split(I, bounds), np.split(J, bounds)):
+            if not rows.size:
+                continue
+            sources = self.members(int(rows[0]))
+            if from_mask is not None:
+                sources = sources[from_mask[sources]]
+            if not sources.size:
+                continue
+            targets = np.concatenate([self.members(col) for col in cols.tolist()])
+            if to_mask is not None:
+                targets = targets[to_mask[targets]]
+            if targets.size:
+                yield sources, targets
+
+    def iter_pairs(self, from_indices: Optional[Iterable[int]] = None,
+                   to_indices: Optional[Iterable[int]] = None) -> Iterator[Tuple[int, int]]:
+        for sources, targets in self.iter_blocks(from_indices, to_indices):
+            targets = targets.tolist()
+            for node_from in sources.tolist():
+                for node_to in targets:
+                    yield node_from, node_to
+
+    def count_pairs(self, from_indices: Optional[Iterable[int]] = None,
+                    to_indices: Optional[Iterable[int]] = None) -> int:
+        return sum([sources.size * targets.size for sources, targets in self.iter_blocks(from_indices, to_indices)])
+
+    def _get_mask(self, indices: Optional[Iterable[int]]) -> Optional[np.ndarray]:
+        if indices is None:
+            return None
+        indices = indices.to_array() if isinstance(indices, ProductStates) else np.fromiter(indices, dtype=np.int64)
+        mask = np.zeros(self.component.size, dtype=bool)
+        mask[indices[(indices >= 0) & (indices < self.component.size)]] = True
+        return mask
+
+
 class GraphWrapper:
+    _BINARY_MAGIC = b'FLGRAPH1'
 
     def __init__(self, edges: List[Edge],
                  start_states: Optional[Set[int]] = None,
                  final_states: Optional[Set[int]] = None):
         label_to_edges: Dict[Any, Tuple[Indices, Indices]] = {}
-        label_to_bool_matrix: Dict[Any, Matrix] = {}
-        self.vertices = set()
         for edge in edges:
             I, J = label_to_edges.setdefault(edge.label, ([], []))
             I.append(edge.node_from)
             J.append(edge.node_to)
-            self.vertices.add(edge.node_from)
-            self.vertices.add(edge.node_to)
-        max_size = 0 if not self.vertices else max(self.vertices) + 1
-        self.matrix_size = max_size
-        for label, (I, J) in label_to_edges.items():
-            label_to_bool_matrix[label] = Matrix.from_lists(I=I, J=J, V=[True] * len(I),
-                                                            ncols=max_size, nrows=max_size, typ=types.BOOL)
-        self.label_to_bool_matrix = label_to_bool_matrix
+        self._build_label_matrices(label_to_edges)
         if start_states is None:
             start_states = self.vertices
         self.start_states = start_states
         if final_states is None:
             final_states = self.vertices
         self.final_states = final_states
+        self.maintained_queries = []
+        self.vertex_mapping: Optional[VertexMapping] = None
+
+    def _build_label_matrices(self, label_to_edges: Dict[Any, Tuple[Iterable[int], Iterable[int]]],
+                              matrix_size: Optional[int] = None):
+        label_to_arrays = {label: (np.asarray(I, dtype=np.int64), np.asarray(J, dtype=np.int64))
+                           for label, (I, J) in label_to_edges.items()}
+        if matrix_size is not None:
+            max_size = matrix_size
+        else:
+            max_size = max([int(max(I.max(), J.max())) + 1 for I, J in label_to_arrays.values() if I.size], default=0)
+        self.matrix_size = max_size
+        present = np.zeros(max_size, dtype=np.bool_)
+        for I, J in label_to_arrays.values():
+            present[I] = True
+            present[J] = True
+        self.vertices = VertexSet.from_bitmap(present)
+        self.label_to_bool_matrix = {label: _bool_matrix_from_arrays(I, J, max_size)
+                                     for label, (I, J) in label_to_arrays.items()}
+
+    @classmethod
+    def _from_label_to_edges(cls, label_to_edges: Dict[Any, Tuple[Indices, Indices]]):
+        instance = cls(edges=[])
+        instance._build_label_matrices(label_to_edges)
+        instance.start_states = instance.vertices
+        instance.final_states = instance.vertices
+        return instance
 
     @classmethod
     def from_list_of_edges(cls, edges: List[Edge]):
         return cls(edges)
 
     @classmethod
-    def from_file(cls, path_to_file: str):
+    def from_file(cls, path_to_file: str, chunk_size: int = 1 << 24, compact=False):
+        start_time = time.perf_counter()
+        label_to_edges: Dict[Any, Tuple[array, array]] = {}
+        index_by_name: Optional[Dict[str, int]] = {} if compact else None
         with open(path_to_file, 'r') as input_file:
-            return cls.from_text(input_file.readlines())
+            while True:
+                lines = input_file.readlines(chunk_size)
+                if not lines:
+                    break
+                cls._parse_edges(lines, label_to_edges, index_by_name)
+        graph = cls._from_label_to_edges(GraphWrapper._as_numpy_edges(label_to_edges))
+        if compact:
+            graph.vertex_mapping = VertexMapping.from_tokens(index_by_name)
+        load_time = time.perf_counter() - start_time
+        edges_num = sum(len(I) for I, _ in label_to_edges.values())
+        logging.info(f'Loaded {edges_num} edges from {path_to_file} in {load_time:.3f} s '
+                     f'({edges_num / max(load_time, 1e-9):.0f} edges/s)')
+        return graph
 
     @classmethod
-    def from_text(cls, text: List[str]):
-        edges = []
-        for line in text:
-            vertex_from, label, vertex_to = line.strip().split(' ')
-            edges.append(Edge(node_from=int(vertex_from),
-                              node_to=int(vertex_to),
-                              label=label))
-        return cls(edges)
+    def from_text(cls, text: List[str], compact=False):
+        label_to_edges: Dict[Any, Tuple[array, array]] = {}
+        index_by_name: Optional[Dict[str, int]] = {} if compact else None
+        cls._parse_edges(text, label_to_edges, index_by_name)
+        graph = cls._from_label_to_edges(GraphWrapper._as_numpy_edges(label_to_edges))
+        if compact:
+            graph.vertex_mapping = VertexMapping.from_tokens(index_by_name)
+        return graph
+
+    def compact(self, order: str = 'identity'):
+        vertices = _as_index_array(self.vertices)
+        adj_matrix = self._adjacency_matrix()
+        I, J, _ = adj_matrix.to_lists()
+        I, J = np.asarray(I, dtype=np.int64), np.asarray(J, dtype=np.int64)
+        if order == 'degree':
+            degrees = np.bincount(I, minlength=self.matrix_size) + np.bincount(J, minlength=self.matrix_size)
+            vertices = vertices[np.argsort(-degrees[vertices], kind='stable')]
+        elif order == 'bfs':
+            vertices = GraphWrapper._get_bfs_order(vertices, np.concatenate([I, J]), np.concatenate([J, I]),
+                                                   self.matrix_size)
+        elif order != 'identity':
+            raise ValueError(f'Unknown vertex order: {order}')
+        new_index = np.full(self.matrix_size, -1, dtype=np.int64)
+        new_index[vertices] = np.arange(vertices.size, dtype=np.int64)
+        label_to_edges: Dict[Any, Tuple[np.ndarray, np.ndarray]] = {}
+        for label, matrix in self.label_to_bool_matrix.items():
+            I, J, _ = matrix.to_lists()
+            label_to_edges[label] = (new_index[np.asarray(I, dtype=np.int64)],
+                                     new_index[np.asarray(J, dtype=np.int64)])
+        graph = GraphWrapper.empty()
+        graph._build_label_matrices(label_to_edges, vertices.size)
+        graph.vertices = VertexSet(np.arange(vertices.size, dtype=np.int64))
+        graph.start_states = (graph.vertices if set(self.start_states) == self.vertices
+                              else set(new_index[sorted(self.start_states)].tolist()))
+        graph.final_states = (graph.vertices if set(self.final_states) == self.vertices
+                              else set(new_index[sorted(self.final_states)].tolist()))
+        graph.vertex_mapping = (VertexMapping(vertices.tolist()) if self.vertex_mapping is None
+                                else self.vertex_mapping.reordered(vertices.tolist()))
+        return graph
+
+    @staticmethod
+    def _get_bfs_order(vertices: np.ndarray, I: np.ndarray, J: np.ndarray, size: int) -> np.ndarray:
+        # Neighbours in either direction get close indices, so label matrices stay banded
+        order = np.argsort(I, kind='stable')
+        targets = J[order].tolist()
+        offsets = np.searchsorted(I[order], np.arange(size + 1)).tolist()
+        visited = [False] * size
+        result: List[int] = []
+        for root in vertices.tolist():
+            if visited[root]:
+                continue
+            visited[root] = True
+            queue = deque([root])
+            while queue:
+                v = queue.popleft()
+                result.append(v)
+                for w in targets[offsets[v]:offsets[v + 1]]:
+                    if not visited[w]:
+                        visited[w] = True
+                        queue.append(w)
+        return np.asarray(result, dtype=np.int64)
+
+    @staticmethod
+    def _as_numpy_edges(label_to_edges: Dict[Any, Tuple[array, array]]) -> Dict[Any, Tuple[np.ndarray, np.ndarray]]:
+        return {label: (np.frombuffer(I, dtype=np.int64), np.frombuffer(J, dtype=np.int64))
+                for label, (I, J) in label_to_edges.items()}
+
+    @staticmethod
+    def _parse_edges(lines: List[str], label_to_edges: Dict[Any, Tuple[array, array]],
+                     index_by_name: Optional[Dict[str, int]] = None):
+        # The chunk is split by numpy's C tokenizer into a fixed-width table, not into a list of Python strings
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', UserWarning)
+                table = np.loadtxt(lines, dtype=str, comments=None, ndmin=2)
+        except ValueError as error:
+            raise ValueError("Incorrect format of the edges, expected 'v_from label v_to' on each line") from error
+        if not table.size:
+            return
+        if table.shape[1] != 3:
+            raise ValueError("Incorrect format of the edges, expected 'v_from label v_to' on each line")
+        if index_by_name is None:
+            I = table[:, 0].astype(np.int64)
+            J = table[:, 2].astype(np.int64)
+        else:
+            # Vertex names of any kind are numbered densely in order of first appearance (not in the sorted order
+            # of np.unique), only distinct names become objects
+            names, first_positions, name_ids = np.unique(table[:, [0, 2]], return_index=True, return_inverse=True)
+            names_list, ids = names.tolist(), np.empty(names.size, dtype=np.int64)
+            for name_id in np.argsort(first_positions, kind='stable').tolist():
+                ids[name_id] = index_by_name.setdefault(names_list[name_id], len(index_by_name))
+            ids = ids[name_ids.reshape(-1, 2)]
+            I, J = ids[:, 0], ids[:, 1]
+        labels, label_ids = np.unique(table[:, 1], return_inverse=True)
+        for label_id, label in enumerate(labels.tolist()):
+            selected = label_ids == label_id
+            I_label, J_label = label_to_edges.setdefault(label, (array('q'), array('q')))
+            I_label.frombytes(I[selected].tobytes())
+            J_label.frombytes(J[selected].tobytes())
+
+    def save_binary(self, path_to_file: str):
+        arrays: List[np.ndarray] = []
+        data_size = 0
+
+        def add_array(values) -> Dict[str, int]:
+            nonlocal data_size
+            values = np.asarray(values, dtype='<i8')
+            arrays.append(values)
+            entry = {'offset': data_size, 'size': int(values.size)}
+            data_size += values.size
+            return entry
+
+        header: Dict[str, Any] = {
+            'matrix_size': self.matrix_size,
+            'vertices': add_array(_as_index_array(self.vertices)),
+            'labels': []
+        }
+        for label, matrix in self.label_to_bool_matrix.items():
+            I, J, _ = matrix.to_lists()
+            # Labels are stored as strings, e.g. pyformlang symbols of a regex constraint come back as their values
+            header['labels'].append({'label': str(label), 'rows': add_array(I), 'cols': add_array(J)})
+        header['start_states'] = (None if set(self.start_states) == self.vertices
+                                  else add_array(_as_index_array(self.start_states)))
+        header['final_states'] = (None if set(self.final_states) == self.vertices
+                                  else add_array(_as_index_array(self.final_states)))
+        header['vertex_names'] = None if self.vertex_mapping is None else self.vertex_mapping.names
+        header['data_size'] = data_size
+        raw_header = json.dumps(header).encode()
+        data_offset = GraphWrapper._binary_data_offset(len(raw_header))
+        with open(path_to_file, 'wb') as output_file:
+            output_file.write(GraphWrapper._BINARY_MAGIC)
+            output_file.write(struct.pack('<Q', len(raw_header)))
+            output_file.write(raw_header)
+            output_file.write(b'\0' * (data_offset - output_file.tell()))
+            for values in arrays:
+                output_file.write(values.tobytes())
+
+    @classmethod
+    def load_binary(cls, path_to_file: str, use_mmap=True):
+        with open(path_to_file, 'rb') as input_file:
+            if input_file.read(len(GraphWrapper._BINARY_MAGIC)) != GraphWrapper._BINARY_MAGIC:
+                raise ValueError(f'{path_to_file} is not a binary graph file')
+            header_size, = struct.unpack('<Q', input_file.read(8))
+            header = json.loads(input_file.read(header_size))
+        data_offset = GraphWrapper._binary_data_offset(header_size)
+        if header['data_size'] == 0:
+            data = np.empty(0, dtype='<i8')
+        elif use_mmap:
+            data = np.memmap(path_to_file, dtype='<i8', mode='r', offset=data_offset, shape=(header['data_size'],))
+        else:
+            data = np.fromfile(path_to_file, dtype='<i8', offset=data_offset, count=header['data_size'])
+
+        def get_array(entry: Dict[str, int]) -> np.ndarray:
+            return data[entry['offset']:entry['offset'] + entry['size']]
+
+        instance = cls(edges=[])
+        size = header['matrix_size']
+        instance.matrix_size = size
+        # Vertex sets stay views of the mapped file and matrices are built straight from its pages
+        instance.vertices = VertexSet(get_array(header['vertices']))
+        instance.label_to_bool_matrix = {
+            entry['label']: _bool_matrix_from_arrays(get_array(entry['rows']), get_array(entry['cols']), size)
+            for entry in header['labels']
+        }
+        instance.start_states = (instance.vertices if header['start_states'] is None
+                                 else VertexSet(get_array(header['start_states'])))
+        instance.final_states = (instance.vertices if header['final_states'] is None
+                                 else VertexSet(get_array(header['final_states'])))
+        if header.get('vertex_names') is not None:
+            instance.vertex_mapping = VertexMapping(header['vertex_names'])
+        return instance
+
+    @classmethod
+    def from_file_with_binary_cache(cls, path_to_file: str):
+        path_to_binary = f'{path_to_file}.bin'
+        if (os.path.exists(path_to_binary)
+                and os.path.getmtime(path_to_binary) >= os.path.getmtime(path_to_file)):
+            return cls.load_binary(path_to_binary)
+        graph = cls.from_file(path_to_file)
+        graph.save_binary(path_to_binary)
+        return graph
+
+    @staticmethod
+    def _binary_data_offset(header_size: int) -> int:
+        unaligned_offset = len(GraphWrapper._BINARY_MAGIC) + 8 + header_size
+        return (unaligned_offset + 7) // 8 * 8
 
     @classmethod
     def empty(cls):
@@ -83,63 +480,368 @@ class GraphWrapper:
     @property
     def vertices_num(self) -> int:
         maximums = [max(matrix.ncols, matrix.nrows) for matrix in self.label_to_bool_matrix.values()]
-        return 0 if not maximums else max(maximums)
+        return self.matrix_size if not maximums else max(maximums)
 
     @property
     def edges_counter(self) -> Dict[Symbol, int]:
         return {label: matrix.nvals for label, matrix in self.label_to_bool_matrix.items()}
 
-    def kronecker_product(self, other):
+    def add_edges(self, edges: Iterable[Edge]) -> Dict[Any, Matrix]:
+        label_to_edges: Dict[Any, Set[Tuple[int, int]]] = {}
+        for edge in edges:
+            label_to_edges.setdefault(edge.label, set()).add((edge.node_from, edge.node_to))
+        max_index = max([max(i, j) for pairs in label_to_edges.values() for i, j in pairs], default=-1)
+        if max_index >= self.matrix_size:
+            self.matrix_size = max_index + 1
+            for matrix in self.label_to_bool_matrix.values():
+                matrix.resize(self.matrix_size, self.matrix_size)
+        added: Dict[Any, Matrix] = {}
+        for label, pairs in label_to_edges.items():
+            matrix = self.label_to_bool_matrix.setdefault(
+                label, Matrix.sparse(types.BOOL, self.matrix_size, self.matrix_size)
+            )
+            new_pairs = [(i, j) for i, j in pairs if matrix.get(i, j) is None]
+            if not new_pairs:
+                continue
+            I, J = [i for i, _ in new_pairs], [j for _, j in new_pairs]
+            added[label] = Matrix.from_lists(I=I, J=J, V=[True] * len(I),
+                                             nrows=self.matrix_size, ncols=self.matrix_size, typ=types.BOOL)
+            with semiring.LOR_LAND_BOOL:
+                matrix += added[label]
+            self.vertices.update(I)
+            self.vertices.update(J)
+        if added:
+            for query in self.maintained_queries:
+                query.on_edges_added(added)
+        return added
+
+    def remove_edges(self, edges: Iterable[Edge]) -> int:
+        removed = 0
+        touched: Set[int] = set()
+        for edge in edges:
+            matrix = self.label_to_bool_matrix.get(edge.label)
+            if matrix is not None and max(edge.node_from, edge.node_to) < self.matrix_size \
+                    and matrix.get(edge.node_from, edge.node_to) is not None:
+                del matrix[edge.node_from, edge.node_to]
+                touched.update((edge.node_from, edge.node_to))
+                removed += 1
+        if removed:
+            # Only the endpoints of removed edges can lose their last edge
+            isolated = [v for v in touched
+                        if all(not matrix.extract_matrix([v], None).nvals
+                               and not matrix.extract_matrix(None, [v]).nvals
+                               for matrix in self.label_to_bool_matrix.values())]
+            self.vertices.difference_update(isolated)
+            for query in self.maintained_queries:
+                query.recompute()
+        return removed
+
+    def kronecker_product(self, other, drop_unreachable=False, labels: Optional[Set[Any]] = None):
         label_to_kronecker_product: Dict[Any, Matrix] = {}
         step = other.matrix_size
-        empty_matrix = Matrix.sparse(typ=types.BOOL, nrows=step, ncols=step)
         for label, matrix in self.label_to_bool_matrix.items():
-            other_matrix: Matrix = other.label_to_bool_matrix.get(label, empty_matrix.dup())
-            result_matrix = matrix.kronecker(other=other_matrix, op=binaryop.TIMES)
-            label_to_kronecker_product[label] = result_matrix
+            if labels is not None and str(label) not in labels:
+                continue
+            other_matrix: Optional[Matrix] = other.label_to_bool_matrix.get(label)
+            if other_matrix is not None and matrix.nvals and other_matrix.nvals:
+                label_to_kronecker_product[label] = matrix.kronecker(other=other_matrix, op=binaryop.TIMES)
         intersection = GraphWrapper._from_label_to_bool_matrix(label_to_kronecker_product)
-        intersection.start_states = list(set(chain(*map(
-            lambda idx: [idx * step + i for i in range(step)],
-            self.start_states
-        ))))
-        intersection.final_states = list(set(chain(*map(
-            lambda idx: [idx * step + i for i in range(step)],
-            self.final_states
-        ))))
+        intersection.matrix_size = self.matrix_size * step
+        intersection.vertices = ProductStates(self.vertices, step, other.vertices)
+        intersection.start_states = ProductStates(self.start_states, step)
+        intersection.final_states = ProductStates(self.final_states, step)
+        if drop_unreachable:
+            intersection._drop_unreachable_states()
         return intersection
 
-    def build_closure_by_squaring(self) -> Matrix:
-        closure = Matrix.sparse(types.BOOL, self.vertices_num, self.vertices_num)
-        prev_nvals = closure.nvals
+    def _drop_unreachable_states(self):
+        seeds = self.start_states.to_array() if isinstance(self.start_states, ProductStates) \
+            else np.fromiter(self.start_states, dtype=np.int64)
+        if not seeds.size or not self.label_to_bool_matrix:
+            self.vertices = set(seeds.tolist())
+            self.label_to_bool_matrix = {}
+            return
+        seed_matrix = Matrix.from_lists(I=[0] * seeds.size, J=seeds.tolist(), V=[True] * seeds.size,
+                                        nrows=1, ncols=self.matrix_size, typ=types.BOOL)
+        _, J, _ = GraphWrapper._expand_frontier(seed_matrix, self._adjacency_matrix()).to_lists()
+        self.vertices = set(seeds.tolist()) | set(J)
+        reachable = sorted(self.vertices)
+        selection = Matrix.from_lists(I=reachable, J=reachable, V=[True] * len(reachable),
+                                      nrows=self.matrix_size, ncols=self.matrix_size, typ=types.BOOL)
         with semiring.LOR_LAND_BOOL:
-            for _, matrix in self.label_to_bool_matrix.items():
-                closure += matrix
-            while prev_nvals != closure.nvals:
-                prev_nvals = closure.nvals
-                closure += closure @ closure
-        return closure
+            self.label_to_bool_matrix = {label: selection @ matrix
+                                         for label, matrix in self.label_to_bool_matrix.items()}
+        self.label_to_bool_matrix = {label: matrix for label, matrix in self.label_to_bool_matrix.items()
+                                     if matrix.nvals}
 
-    def build_closure_by_adj_matrix_multiplication(self) -> Matrix:
+    def _adjacency_matrix(self) -> Matrix:
         adj_matrix = Matrix.sparse(types.BOOL, self.vertices_num, self.vertices_num)
-        prev_nvals = adj_matrix.nvals
         with semiring.LOR_LAND_BOOL:
             for _, matrix in self.label_to_bool_matrix.items():
                 adj_matrix += matrix
-            closure = adj_matrix.dup()
-            while prev_nvals != closure.nvals:
-                prev_nvals = closure.nvals
-                closure += adj_matrix @ closure
+        return adj_matrix
+
+    def build_closure_by_squaring(self) -> Matrix:
+        closure = Matrix.sparse(types.BOOL, self.vertices_num, self.vertices_num)
+        GraphWrapper._expand_closure(closure, self._adjacency_matrix())
         return closure
 
-    def get_reachable_pairs(self, from_indices: Set[int], to_indices: Set[int]):
-        reachability_matrix = self.build_closure_by_squaring()
-        result: List[Tuple[int, int]] = []
-        for from_index in from_indices:
-            for to_index in to_indices:
-                if reachability_matrix.get(from_index, to_index, False):
-                    result.append((from_index, to_index))
+    def build_closure_by_condensation(self) -> CondensedClosure:
+        # Strongly connected components are collapsed first, so the closure is built over the DAG of components
+        adj_matrix = self._adjacency_matrix()
+        component, components_num = GraphWrapper._get_strongly_connected_components(adj_matrix)
+        closure = Matrix.sparse(types.BOOL, components_num, components_num)
+        if components_num:
+            membership = Matrix.from_lists(I=list(range(component.size)), J=component.tolist(),
+                                           V=[True] * component.size, nrows=component.size, ncols=components_num,
+                                           typ=types.BOOL)
+            with semiring.LOR_LAND_BOOL:
+                condensed = membership.transpose() @ adj_matrix @ membership
+            GraphWrapper._expand_closure(closure, condensed)
+        return CondensedClosure(component, closure)
+
+    @staticmethod
+    def _get_strongly_connected_components(adj_matrix: Matrix) -> Tuple[np.ndarray, int]:
+        # Forward-backward colouring: every vertex is coloured with the least index among its ancestors, and
+        # the vertices reaching a colour root backwards through edges of that colour form the root's component
+        size = adj_matrix.nrows
+        I, J, _ = adj_matrix.to_lists()
+        I, J = np.asarray(I, dtype=np.int64), np.asarray(J, dtype=np.int64)
+        component = np.full(size, -1, dtype=np.int64)
+        active = np.ones(size, dtype=bool)
+        components_num = 0
+        while active.any():
+            inside = active[I] & active[J]
+            I, J = I[inside], J[inside]
+            # Vertices without incoming or outgoing edges among the remaining ones are components by themselves
+            trimmed = active & ((np.bincount(I, minlength=size) == 0) | (np.bincount(J, minlength=size) == 0))
+            if trimmed.any():
+                vertices = np.flatnonzero(trimmed)
+                component[vertices] = np.arange(components_num, components_num + vertices.size)
+                components_num += vertices.size
+                active &= ~trimmed
+                continue
+            vertices = np.flatnonzero(active)
+            colors = GraphWrapper._get_min_ancestor_colors(vertices, I, J, size)
+            same_color = colors[I] == colors[J]
+            roots = vertices[colors[vertices] == vertices]
+            members = GraphWrapper._get_backward_reachable(roots, I[same_color], J[same_color], size)
+            _, ids = np.unique(colors[members], return_inverse=True)
+            component[members] = components_num + ids
+            components_num += int(ids.max()) + 1
+            active[members] = False
+        return component, components_num
+
+    @staticmethod
+    def _get_min_ancestor_colors(vertices: np.ndarray, I: np.ndarray, J: np.ndarray, size: int) -> np.ndarray:
+        weights = Matrix.from_lists(I=I.tolist(), J=J.tolist(), V=[0] * I.size, nrows=size, ncols=size,
+                                    typ=types.INT64)
+        colors = Matrix.from_lists(I=[0] * vertices.size, J=vertices.tolist(), V=vertices.tolist(),
+                                   nrows=1, ncols=size, typ=types.INT64)
+        with semiring.MIN_PLUS_INT64:
+            while True:
+                updated = colors.eadd(colors @ weights, binaryop.MIN_INT64)
+                if updated.iseq(colors):
+                    break
+                colors = updated
+        _, indices, values = colors.to_lists()
+        result = np.full(size, -1, dtype=np.int64)
+        result[np.asarray(indices, dtype=np.int64)] = np.asarray(values, dtype=np.int64)
+        return result
+
+    @staticmethod
+    def _get_backward_reachable(roots: np.ndarray, I: np.ndarray, J: np.ndarray, size: int) -> np.ndarray:
+        adj_matrix = _bool_matrix_from_arrays(I, J, size)
+        frontier = _bool_matrix_from_arrays(roots, np.zeros_like(roots), size, 1)
+        reachable = frontier.dup()
+        with semiring.LOR_LAND_BOOL:
+            while frontier.nvals:
+                frontier = adj_matrix.mxm(frontier, mask=reachable, desc=descriptor.RC)
+                reachable += frontier
+        rows, _, _ = reachable.to_lists()
+        return np.asarray(rows, dtype=np.int64)
+
+    def build_closure_by_adj_matrix_multiplication(self) -> Matrix:
+        adj_matrix = self._adjacency_matrix()
+        return GraphWrapper._expand_frontier(adj_matrix.dup(), adj_matrix)
+
+    def build_closure_from(self, sources: Iterable[int]) -> Matrix:
+        sources = self._restrict_indices(sources)
+        if not sources.size:
+            return Matrix.sparse(types.BOOL, self.vertices_num, self.vertices_num)
+        selection = _bool_matrix_from_arrays(sources, sources, self.vertices_num)
+        adj_matrix = self._adjacency_matrix()
+        with semiring.LOR_LAND_BOOL:
+            return GraphWrapper._expand_frontier(selection @ adj_matrix, adj_matrix)
+
+    @staticmethod
+    def _expand_frontier(frontier: Matrix, adj_matrix: Matrix) -> Matrix:
+        reachable = frontier.dup()
+        with semiring.LOR_LAND_BOOL:
+            while frontier.nvals:
+                frontier = frontier.mxm(adj_matrix, mask=reachable, desc=descriptor.RC)
+                reachable += frontier
+        return reachable
+
+    @staticmethod
+    def _expand_closure(closure: Matrix, new_edges: Matrix) -> Matrix:
+        added = new_edges.dup()
+        with semiring.LOR_LAND_BOOL:
+            closure += new_edges
+            frontier = new_edges
+            while frontier.nvals:
+                frontier = (frontier.mxm(closure, mask=closure, desc=descriptor.RC)
+                            + closure.mxm(frontier, mask=closure, desc=descriptor.RC))
+                closure += frontier
+                added += frontier
+        return added
+
+    def get_reachable_pairs(self, from_indices: Iterable[int], to_indices: Iterable[int], as_arrays=False):
+        from_array, to_array = self._restrict_indices(from_indices), self._restrict_indices(to_indices)
+        if not from_array.size or not to_array.size:
+            rows, cols = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        else:
+            reachability_matrix = self.build_closure_from(from_array)
+            I, J, _ = reachability_matrix.extract_matrix(from_array.tolist(), to_array.tolist()).to_lists()
+            rows = from_array[np.asarray(I, dtype=np.int64)]
+            cols = to_array[np.asarray(J, dtype=np.int64)]
+        if as_arrays:
+            return rows, cols
+        return list(zip(rows.tolist(), cols.tolist()))
+
+    @staticmethod
+    def _unique_pairs(rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if not rows.size:
+            return rows, cols
+        pairs = np.unique(np.stack([rows, cols], axis=1), axis=0)
+        return pairs[:, 0], pairs[:, 1]
+
+    def has_reachable_pair(self, from_indices: Iterable[int], to_indices: Iterable[int]) -> bool:
+        from_array, to_array = self._restrict_indices(from_indices), self._restrict_indices(to_indices)
+        if not from_array.size or not to_array.size:
+            return False
+        adj_matrix = self._adjacency_matrix()
+        seed = _bool_matrix_from_arrays(np.zeros_like(from_array), from_array, 1, self.vertices_num)
+        targets = _bool_matrix_from_arrays(np.zeros_like(to_array), to_array, 1, self.vertices_num)
+        with semiring.LOR_LAND_BOOL:
+            frontier = seed @ adj_matrix
+            reachable = frontier.dup()
+            while frontier.nvals:
+                if frontier.emult(targets).nvals:
+                    return True
+                frontier = frontier.mxm(adj_matrix, mask=reachable, desc=descriptor.RC)
+                reachable += frontier
+        return False
+
+    def count_reachable_pairs(self, from_indices: Iterable[int], to_indices: Iterable[int],
+                              modulo: Optional[int] = None) -> int:
+        from_array, to_array = self._restrict_indices(from_indices), self._restrict_indices(to_indices)
+        if not from_array.size or not to_array.size:
+            return 0
+        reachable = self.build_closure_from(from_array).extract_matrix(from_array.tolist(), to_array.tolist())
+        if modulo is None:
+            return reachable.nvals
+        # Pairs of product states are projected onto pairs of their vertices, duplicates merge by OR
+        rows_projection = _bool_matrix_from_arrays(np.arange(from_array.size, dtype=np.int64), from_array % modulo,
+                                                   from_array.size, modulo)
+        cols_projection = _bool_matrix_from_arrays(np.arange(to_array.size, dtype=np.int64), to_array % modulo,
+                                                   to_array.size, modulo)
+        with semiring.LOR_LAND_BOOL:
+            return (rows_projection.transpose() @ reachable @ cols_projection).nvals
+
+    def _restrict_indices(self, indices: Iterable[int]) -> np.ndarray:
+        # Product states and vertex sets are already sorted arrays, other iterables are sorted once with numpy
+        if isinstance(indices, (VertexSet, ProductStates)):
+            array = indices.to_array()
+        elif isinstance(indices, range):
+            array = np.arange(indices.start, indices.stop, indices.step, dtype=np.int64)
+        else:
+            array = np.unique(np.fromiter(indices, dtype=np.int64))
+        return array[(array >= 0) & (array < self.vertices_num)]
+
+    def get_reachable_pairs_by_bfs(self, constraint, from_indices: Iterable[int],
+                                   to_indices: Optional[Set[int]] = None, as_arrays=False):
+        sources = self._restrict_indices(from_indices)
+        if not sources.size:
+            empty = np.empty(0, dtype=np.int64)
+            return (empty, empty) if as_arrays else set()
+        I, J, _ = self._get_reachable_matrix_by_bfs(constraint, sources, to_indices).to_lists()
+        rows = sources[np.asarray(I, dtype=np.int64)]
+        cols = np.asarray(J, dtype=np.int64)
+        if as_arrays:
+            return rows, cols
+        return set(zip(rows.tolist(), cols.tolist()))
+
+    def has_reachable_pair_by_bfs(self, constraint, from_indices: Iterable[int],
+                                  to_indices: Optional[Set[int]] = None) -> bool:
+        sources = self._restrict_indices(from_indices)
+        if not sources.size:
+            return False
+        return self._get_reachable_matrix_by_bfs(constraint, sources, to_indices, exists=True).nvals > 0
+
+    def count_reachable_pairs_by_bfs(self, constraint, from_indices: Iterable[int],
+                                     to_indices: Optional[Set[int]] = None) -> int:
+        sources = self._restrict_indices(from_indices)
+        if not sources.size:
+            return 0
+        return self._get_reachable_matrix_by_bfs(constraint, sources, to_indices).nvals
+
+    def _get_reachable_matrix_by_bfs(self, constraint, sources: np.ndarray, to_indices: Optional[Set[int]],
+                                     exists=False) -> Matrix:
+        cols_num = self.vertices_num
+        # An existence check does not need to know which source a path started from
+        rows = np.zeros_like(sources) if exists else np.arange(sources.size, dtype=np.int64)
+        rows_num = int(rows[-1]) + 1
+        seed = _bool_matrix_from_arrays(rows, sources, rows_num, cols_num)
+        targets = None
+        if to_indices is not None:
+            to_array = self._restrict_indices(to_indices)
+            targets = _bool_matrix_from_arrays(to_array, to_array, cols_num)
+        final_states = set(constraint.final_states)
+
+        def is_final(state: int, matrix: Matrix) -> bool:
+            return state in final_states and (matrix if targets is None else matrix @ targets).nvals > 0
+
+        visited = self._traverse_product(constraint, {(None, state): seed for state in constraint.start_states},
+                                         stop=(lambda key, matrix: is_final(key[1], matrix)) if exists else None)
+        result = Matrix.sparse(types.BOOL, rows_num, cols_num)
+        with semiring.LOR_LAND_BOOL:
+            for (_, state), matrix in visited.items():
+                if state in final_states:
+                    result += matrix
+            if targets is not None:
+                result = result @ targets
         return result
 
+    def _traverse_product(self, automaton, frontier: Dict[Tuple[Any, int], Matrix],
+                          stop: Optional[Callable[[Tuple[Any, int], Matrix], bool]] = None
+                          ) -> Dict[Tuple[Any, int], Matrix]:
+        # Walks automaton ⊗ self one label block at a time: X[s'] += X[s] @ G[l] for every transition s -l-> s'.
+        # Keys are (tag, automaton state), rows of each block are the sources the walk started from.
+        transitions_by_state: Dict[int, List[Tuple[int, Matrix]]] = {}
+        for label, automaton_matrix in automaton.label_to_bool_matrix.items():
+            if label not in self.label_to_bool_matrix:
+                continue
+            for state_from, state_to, _ in automaton_matrix:
+                transitions_by_state.setdefault(state_from, []).append((state_to, self.label_to_bool_matrix[label]))
+        visited: Dict[Tuple[Any, int], Matrix] = {}
+        with semiring.LOR_LAND_BOOL:
+            while frontier:
+                next_frontier: Dict[Tuple[Any, int], Matrix] = {}
+                for (tag, state_from), state_frontier in frontier.items():
+                    rows_num, cols_num = state_frontier.nrows, state_frontier.ncols
+                    for state_to, matrix in transitions_by_state.get(state_from, []):
+                        key = (tag, state_to)
+                        reached = visited.setdefault(key, Matrix.sparse(types.BOOL, rows_num, cols_num))
+                        step = next_frontier.setdefault(key, Matrix.sparse(types.BOOL, rows_num, cols_num))
+                        step += state_frontier.mxm(matrix, mask=reached, desc=descriptor.RC)
+                for key, step in next_frontier.items():
+                    visited[key] += step
+                frontier = {key: step for key, step in next_frontier.items() if step.nvals}
+                if stop is not None and any(stop(key, step) for key, step in frontier.items()):
+                    break
+        return visited
+
     def to_nfa(self, start_states: Indices, final_states: Indices):
         self.start_states = start_states
         self.final_states = final_states
@@ -155,56 +857,172 @@ class GraphWrapper:
                 nfa.add_transition(states[i], symbols[label], states[j])
         return nfa
 
-    def cfpq_hellings(self, grammar: GrammarWrapper) -> Set[Tuple[int, int]]:
-        result: Dict[Variable, Matrix] = {}
+    def _get_reachable_vertices(self, seeds: Iterable[int], backward=False) -> np.ndarray:
+        # Label matrices are multiplied one by one, so no adjacency matrix of the whole graph is built
+        seeds = [idx for idx in set(seeds) if idx in self.vertices]
+        if not seeds:
+            return np.empty(0, dtype=np.int64)
+        if backward:
+            frontier = Matrix.from_lists(I=seeds, J=[0] * len(seeds), V=[True] * len(seeds),
+                                         nrows=self.matrix_size, ncols=1, typ=types.BOOL)
+        else:
+            frontier = Matrix.from_lists(I=[0] * len(seeds), J=seeds, V=[True] * len(seeds),
+                                         nrows=1, ncols=self.matrix_size, typ=types.BOOL)
+        reachable = frontier.dup()
+        with semiring.LOR_LAND_BOOL:
+            while frontier.nvals:
+                step = Matrix.sparse(types.BOOL, frontier.nrows, frontier.ncols)
+                for matrix in self.label_to_bool_matrix.values():
+                    if backward:
+                        step += matrix.mxm(frontier, mask=reachable, desc=descriptor.RC)
+                    else:
+                        step += frontier.mxm(matrix, mask=reachable, desc=descriptor.RC)
+                reachable += step
+                frontier = step
+        I, J, _ = reachable.to_lists()
+        return np.unique(np.asarray(I if backward else J, dtype=np.int64))
+
+    def _get_region_graph(self, from_vertices: Optional[Iterable[int]], to_vertices: Optional[Iterable[int]]):
+        region = None
+        if from_vertices is not None:
+            region = self._get_reachable_vertices(from_vertices)
+        if to_vertices is not None and (region is None or region.size):
+            reachable = self._get_reachable_vertices(to_vertices, backward=True)
+            region = reachable if region is None else np.intersect1d(region, reachable)
+        # The region is renumbered densely, region[i] is the vertex i of the region graph
+        region_graph = GraphWrapper.empty()
+        region_graph.matrix_size = int(region.size)
+        indices = region.tolist()
+        region_graph.label_to_bool_matrix = {label: matrix.extract_matrix(indices, indices)
+                                             for label, matrix in self.label_to_bool_matrix.items()}
+        region_graph.vertices = VertexSet(np.arange(region.size, dtype=np.int64))
+        region_graph.start_states = region_graph.vertices
+        region_graph.final_states = region_graph.vertices
+        return region_graph, region
+
+    def _cfpq_in_region(self, solve, from_vertices: Optional[Iterable[int]], to_vertices: Optional[Iterable[int]]):
+        from_vertices = None if from_vertices is None else set(from_vertices)
+        to_vertices = None if to_vertices is None else set(to_vertices)
+        region_graph, region = self._get_region_graph(from_vertices, to_vertices)
+        result = solve(region_graph)
+        pairs, extractor = result if isinstance(result, tuple) else (result, None)
+        pairs = set([(int(region[i]), int(region[j])) for i, j in pairs])
+        pairs = set([(i, j) for i, j in pairs
+                     if (from_vertices is None or i in from_vertices) and (to_vertices is None or j in to_vertices)])
+        return pairs if extractor is None else (pairs, MappedPathExtractor(extractor, VertexMapping(region.tolist())))
+
+    @_with_vertex_mapping
+    def cfpq_hellings(self, grammar: GrammarWrapper, blocked=False, from_vertices: Optional[Iterable[int]] = None,
+                      to_vertices: Optional[Iterable[int]] = None, prune=True) -> Set[Tuple[int, int]]:
+        if from_vertices is not None or to_vertices is not None:
+            return self._cfpq_in_region(lambda graph: graph.cfpq_hellings(grammar, blocked, prune=prune),
+                                        from_vertices, to_vertices)
+        if prune:
+            grammar = grammar.pruned(self.label_to_bool_matrix.keys())
+        if blocked:
+            return self._cfpq_hellings_blocked(grammar)
+        rows: Dict[Variable, Dict[int, Set[int]]] = {}
+        cols: Dict[Variable, Dict[int, Set[int]]] = {}
         working_queue = deque()
+
+        def add(node_from: int, node_to: int, var: Variable):
+            var_rows = rows.setdefault(var, {}).setdefault(node_from, set())
+            if node_to not in var_rows:
+                var_rows.add(node_to)
+                cols.setdefault(var, {}).setdefault(node_to, set()).add(node_from)
+                working_queue.append((node_from, node_to, var))
+
         if grammar.generate_epsilon:
-            result[grammar.cfg.start_symbol] = Matrix.sparse(types.BOOL, self.vertices_num, self.vertices_num)
             for v in self.vertices:
-                result[grammar.cfg.start_symbol][v, v] = True
-                working_queue.append((v, v, grammar.cfg.start_symbol))
+                add(v, v, grammar.cfg.start_symbol)
+        for label, matrix in self.label_to_bool_matrix.items():
+            heads = grammar.heads_by_terminal.get(Terminal(label), ())
+            if not heads:
+                continue
+            I, J, _ = matrix.to_lists()
+            for head in heads:
+                for i, j in zip(I, J):
+                    add(i, j, head)
+        while working_queue:
+            node_from, node_to, var = working_queue.popleft()
+            for var_before, heads in grammar.pairs_by_right_var.get(var, ()):
+                for node_before in tuple(cols.get(var_before, {}).get(node_from, ())):
+                    for head in heads:
+                        add(node_before, node_to, head)
+            for var_after, heads in grammar.pairs_by_left_var.get(var, ()):
+                for node_after in tuple(rows.get(var_after, {}).get(node_to, ())):
+                    for head in heads:
+                        add(node_from, node_after, head)
+        return set([(i, j) for i, row in rows.get(grammar.cfg.start_symbol, {}).items() for j in row])
+
+    def _cfpq_hellings_blocked(self, grammar: GrammarWrapper) -> Set[Tuple[int, int]]:
+        result: Dict[Variable, Matrix] = {}
+        pending: Dict[Variable, Matrix] = {}
+        working_queue = deque()
+
+        def add(var: Variable, matrix: Matrix):
+            if var in pending:
+                pending[var] += matrix
+            else:
+                pending[var] = matrix
+                working_queue.append(var)
+            if var in result:
+                result[var] += matrix
+            else:
+                result[var] = matrix.dup()
+
         with semiring.LOR_LAND_BOOL:
+            initial: Dict[Variable, Matrix] = {}
+            if grammar.generate_epsilon:
+                vertices = list(self.vertices)
+                initial[grammar.cfg.start_symbol] = Matrix.from_lists(
+                    I=vertices, J=vertices, V=[True] * len(vertices),
+                    nrows=self.matrix_size, ncols=self.matrix_size, typ=types.BOOL
+                )
             for label, matrix in self.label_to_bool_matrix.items():
-                for prod in grammar.cnf.productions:
-                    if len(prod.body) == 1 and Terminal(label) == prod.body[0]:
-                        if prod.head in result:
-                            result[prod.head] += matrix.dup()
+                for head in grammar.heads_by_terminal.get(Terminal(label), ()):
+                    if head in initial:
+                        initial[head] += matrix
+                    else:
+                        initial[head] = matrix.dup()
+            for var, matrix in initial.items():
+                add(var, matrix)
+            # Every fact is queued exactly once, but a whole delta matrix of facts is joined per step
+            while working_queue:
+                var = working_queue.popleft()
+                delta = pending.pop(var)
+                products = [(result[var_before], delta, heads)
+                            for var_before, heads in grammar.pairs_by_right_var.get(var, ())
+                            if var_before in result]
+                products += [(delta, result[var_after], heads)
+                             for var_after, heads in grammar.pairs_by_left_var.get(var, ())
+                             if var_after in result]
+                for left, right, heads in products:
+                    for head in heads:
+                        if head in result:
+                            new_facts = left.mxm(right, mask=result[head], desc=descriptor.RC)
                         else:
-                            result[prod.head] = matrix.dup()
-                        for i, j, _ in matrix:
-                            working_queue.append((i, j, prod.head))
-        while len(working_queue) != 0:
-            node_from, node_to, var = working_queue.popleft()
-            update = []
-            for var_before, matrix in result.items():
-                for node_before, _ in matrix[:, node_from]:
-                    for prod in grammar.cnf.productions:
-                        if (len(prod.body) == 2
-                                and prod.body[0] == var_before
-                                and prod.body[1] == var
-                                and (prod.head not in result
-                                     or result[prod.head].get(node_before, node_to) is None)):
-                            update.append((node_before, node_to, prod.head))
-            for var_after, matrix in result.items():
-                for node_after, _ in matrix[node_to]:
-                    for prod in grammar.cnf.productions:
-                        if (len(prod.body) == 2
-                                and prod.body[0] == var
-                                and prod.body[1] == var_after
-                                and (prod.head not in result
-                                     or result[prod.head].get(node_from, node_after) is None)):
-                            update.append((node_from, node_after, prod.head))
-            for node_from, node_to, var in update:
-                working_queue.append((node_from, node_to, var))
-                if var in result:
-                    result[var][node_from, node_to] = True
-                else:
-                    empty_matrix = Matrix.sparse(types.BOOL, self.vertices_num, self.vertices_num)
-                    result[var] = empty_matrix
-                    result[var][node_from, node_to] = True
+                            new_facts = left @ right
+                        if new_facts.nvals:
+                            add(head, new_facts)
         return set([(i, j) for i, j, _ in result.get(grammar.cfg.start_symbol, [])])
 
-    def cfpq_matrices(self, grammar: GrammarWrapper) -> Set[Tuple[int, int]]:
+    @_with_vertex_mapping
+    def cfpq_matrices(self, grammar: GrammarWrapper, mode: str = 'naive', with_witnesses=False,
+                      from_vertices: Optional[Iterable[int]] = None, to_vertices: Optional[Iterable[int]] = None,
+                      prune=True):
+        if mode not in ('naive', 'delta'):
+            raise ValueError(f'Unknown evaluation mode for matrix-based CFPQ: {mode}')
+        if with_witnesses and mode != 'naive':
+            raise ValueError('Witnesses for matrix-based CFPQ are computed only in the naive mode')
+        if from_vertices is not None or to_vertices is not None:
+            return self._cfpq_in_region(lambda graph: graph.cfpq_matrices(grammar, mode, with_witnesses, prune=prune),
+                                        from_vertices, to_vertices)
+        if prune:
+            grammar = grammar.pruned(self.label_to_bool_matrix.keys())
+        if with_witnesses:
+            eps_heads = {grammar.cfg.start_symbol} if grammar.generate_epsilon else set()
+            return self._cfpq_with_witnesses(grammar.cnf.productions, eps_heads, grammar.cfg.start_symbol)
         result: Dict[Variable, Matrix] = {}
         if grammar.generate_epsilon:
             result[grammar.cfg.start_symbol] = Matrix.sparse(types.BOOL, self.vertices_num, self.vertices_num)
@@ -224,6 +1042,9 @@ class GraphWrapper:
                             result[production.head] += matrix.dup()
                         else:
                             result[production.head] = matrix.dup()
+            if mode == 'delta':
+                self._cfpq_matrices_delta(result, nonterm_productions)
+                return set([(i, j) for i, j, _ in result.get(grammar.cfg.start_symbol, [])])
             has_changed = True
             while has_changed:
                 has_changed = False
@@ -237,13 +1058,79 @@ class GraphWrapper:
                     has_changed |= result[production.head].nvals != old_nvals
         return set([(i, j) for i, j, _ in result.get(grammar.cfg.start_symbol, [])])
 
-    def cfpq_tensors(self, grammar: GrammarWrapper, from_wcnf=False) -> Set[Tuple[int, int]]:
+    def _cfpq_matrices_delta(self, result: Dict[Variable, Matrix], nonterm_productions: Set[Production],
+                             delta: Optional[Dict[Variable, Matrix]] = None):
+        if delta is None:
+            delta = {var: matrix.dup() for var, matrix in result.items()}
+        with semiring.LOR_LAND_BOOL:
+            while delta:
+                new_delta: Dict[Variable, Matrix] = {}
+                for production in nonterm_productions:
+                    head, (left, right) = production.head, production.body
+                    if left not in result or right not in result or (left not in delta and right not in delta):
+                        continue
+                    total = result.setdefault(head, Matrix.sparse(types.BOOL, self.matrix_size, self.matrix_size))
+                    update = new_delta.setdefault(head, Matrix.sparse(types.BOOL, self.matrix_size, self.matrix_size))
+                    if left in delta:
+                        update += delta[left].mxm(result[right], mask=total, desc=descriptor.RC)
+                    if right in delta:
+                        update += result[left].mxm(delta[right], mask=total, desc=descriptor.RC)
+                for var, update in new_delta.items():
+                    result[var] += update
+                delta = {var: update for var, update in new_delta.items() if update.nvals}
+
+    def _cfpq_with_witnesses(self, productions: Iterable[Production], eps_heads: Set[Variable],
+                             start_symbol: Variable) -> Tuple[Set[Tuple[int, int]], PathExtractor]:
+        size = self.matrix_size
+        lengths: Dict[Any, Matrix] = {}
+        for label, matrix in self.label_to_bool_matrix.items():
+            I, J, _ = matrix.to_lists()
+            lengths[Terminal(label)] = Matrix.from_lists(I=I, J=J, V=[1] * len(I), nrows=size, ncols=size,
+                                                         typ=types.INT64)
+        vertices = sorted(self.vertices)
+        for head in eps_heads:
+            lengths[head] = Matrix.sparse(types.INT64, size, size)
+            for v in vertices:
+                lengths[head][v, v] = 0
+        productions = [production for production in productions if production.body]
+        has_changed = True
+        with semiring.MIN_PLUS_INT64:
+            while has_changed:
+                has_changed = False
+                for production in productions:
+                    if any(symbol not in lengths for symbol in production.body):
+                        continue
+                    product = lengths[production.body[0]]
+                    for symbol in production.body[1:]:
+                        product = product @ lengths[symbol]
+                    current = lengths.get(production.head)
+                    updated = product if current is None else current.eadd(product, binaryop.MIN_INT64)
+                    if current is None or not updated.iseq(current):
+                        lengths[production.head] = updated
+                        has_changed = True
+        pairs = set([(i, j) for i, j, _ in lengths.get(start_symbol, [])])
+        return pairs, PathExtractor(lengths, productions, eps_heads, start_symbol, self.vertices_num)
+
+    @_with_vertex_mapping
+    def cfpq_tensors(self, grammar: GrammarWrapper, from_wcnf=False, incremental=False, with_witnesses=False,
+                     from_vertices: Optional[Iterable[int]] = None, to_vertices: Optional[Iterable[int]] = None,
+                     implicit=False, condensed=False):
+        if from_vertices is not None or to_vertices is not None:
+            return self._cfpq_in_region(
+                lambda graph: graph.cfpq_tensors(grammar, from_wcnf, incremental, with_witnesses,
+                                                 implicit=implicit, condensed=condensed),
+                from_vertices, to_vertices
+            )
+        if with_witnesses and (incremental or implicit or condensed):
+            raise ValueError('Witnesses for tensor-based CFPQ are computed only by the default evaluation')
         current_cfg = grammar.wcnf if from_wcnf else grammar.cfg
         import wrappers.RFA
         rfa = wrappers.RFA.from_cfg(current_cfg)
-        return self._cfpq_tensors_from_rfa(rfa)
+        if with_witnesses:
+            return self._cfpq_tensors_with_lengths(rfa, current_cfg.productions)
+        return self._cfpq_tensors_from_rfa(rfa, incremental, implicit, condensed)
 
-    def _cfpq_tensors_from_rfa(self, rfa):
+    def _cfpq_tensors_from_rfa(self, rfa, incremental=False, implicit=False, condensed=False):
         empty_matrix = Matrix.sparse(types.BOOL, self.matrix_size, self.matrix_size)
         result = {label: matrix.dup() for label, matrix in self.label_to_bool_matrix.items()}
         for (state_from, state_to), head in rfa.head_by_start_final_pair.items():
@@ -256,18 +1143,136 @@ class GraphWrapper:
             for v in self.vertices:
                 result[prod.head][v, v] = True
         result = GraphWrapper._from_label_to_bool_matrix(result)
+        if implicit:
+            return GraphWrapper._cfpq_tensors_implicit(rfa, result)
+        if incremental:
+            return GraphWrapper._cfpq_tensors_incremental(rfa, result)
         has_changed = True
         while has_changed:
             tensor_product = rfa.graph.kronecker_product(result)
-            closure = tensor_product.build_closure_by_squaring()
+            start_states, final_states = tensor_product.start_states, tensor_product.final_states
+            if condensed:
+                pairs = tensor_product.build_closure_by_condensation().iter_pairs(start_states, final_states)
+            else:
+                pairs = ((i, j) for i, j, _ in tensor_product.build_closure_by_squaring()
+                         if i in start_states and j in final_states)
+            has_changed = False
+            for i, j in pairs:
+                i_graph, j_graph = i % result.matrix_size, j % result.matrix_size
+                i_rfa, j_rfa = i // result.matrix_size, j // result.matrix_size
+                var = rfa.head_by_start_final_pair[i_rfa, j_rfa]
+                matrix = result.label_to_bool_matrix.setdefault(var, empty_matrix.dup())
+                if not matrix.get(i_graph, j_graph, False):
+                    has_changed = True
+                matrix[i_graph, j_graph] = True
+        return set([(i, j) for i, j, _ in result.label_to_bool_matrix.get(rfa.start_symbol, [])])
+
+    def _cfpq_tensors_with_lengths(self, rfa, productions: Iterable[Production]
+                                   ) -> Tuple[Set[Tuple[int, int]], PathExtractor]:
+        # The tensor algorithm over MIN_PLUS: graph edges weigh 1, RFA edges weigh 0,
+        # so the closure of the product gives the shortest derivation of every box
+        step = self.matrix_size
+        lengths: Dict[Any, Matrix] = {}
+        for label, matrix in self.label_to_bool_matrix.items():
+            I, J, _ = matrix.to_lists()
+            lengths[label] = Matrix.from_lists(I=I, J=J, V=[1] * len(I), nrows=step, ncols=step, typ=types.INT64)
+        vertices = sorted(self.vertices)
+        eps_heads = set([prod.head.value for prod in rfa.eps_productions])
+        eps_heads.update([head for (state_from, state_to), head in rfa.head_by_start_final_pair.items()
+                          if state_from == state_to])
+        for head in eps_heads:
+            lengths[head] = Matrix.from_lists(I=vertices, J=vertices, V=[0] * len(vertices),
+                                              nrows=step, ncols=step, typ=types.INT64)
+        rfa_size = rfa.graph.matrix_size
+        rfa_weights: Dict[Any, Matrix] = {}
+        for label, matrix in rfa.graph.label_to_bool_matrix.items():
+            I, J, _ = matrix.to_lists()
+            rfa_weights[label] = Matrix.from_lists(I=I, J=J, V=[0] * len(I), nrows=rfa_size, ncols=rfa_size,
+                                                   typ=types.INT64)
+        boxes = [(state_from, state_to, head) for (state_from, state_to), head in rfa.head_by_start_final_pair.items()
+                 if state_from != state_to]
+        has_changed = True
+        while has_changed:
+            has_changed = False
+            product = Matrix.sparse(types.INT64, rfa_size * step, rfa_size * step)
+            for label, weights in rfa_weights.items():
+                if label in lengths and lengths[label].nvals:
+                    product = product.eadd(weights.kronecker(lengths[label], op=binaryop.PLUS_INT64),
+                                           binaryop.MIN_INT64)
+            closure = product
+            with semiring.MIN_PLUS_INT64:
+                while True:
+                    squared = closure.eadd(closure @ closure, binaryop.MIN_INT64)
+                    if squared.iseq(closure):
+                        break
+                    closure = squared
+            I, J, V = (np.asarray(values, dtype=np.int64) for values in closure.to_lists())
+            for state_from, state_to, head in boxes:
+                selected = (I // step == state_from) & (J // step == state_to)
+                if not selected.any():
+                    continue
+                found = Matrix.from_lists(I=(I[selected] % step).tolist(), J=(J[selected] % step).tolist(),
+                                          V=V[selected].tolist(), nrows=step, ncols=step, typ=types.INT64)
+                current = lengths.get(head)
+                updated = found if current is None else current.eadd(found, binaryop.MIN_INT64)
+                if current is None or not updated.iseq(current):
+                    lengths[head] = updated
+                    has_changed = True
+        heads = set([prod.head.value for prod in productions])
+        symbol_lengths = {(Variable(symbol) if symbol in heads else Terminal(symbol)): matrix
+                          for symbol, matrix in lengths.items()}
+        start_lengths = symbol_lengths.get(rfa.start_symbol)
+        pairs = set() if start_lengths is None else set([(i, j) for i, j, _ in start_lengths])
+        return pairs, PathExtractor(symbol_lengths, productions, set([Variable(head) for head in eps_heads]),
+                                    rfa.start_symbol, self.vertices_num)
+
+    @staticmethod
+    def _cfpq_tensors_implicit(rfa, result) -> Set[Tuple[int, int]]:
+        step = result.matrix_size
+        identity = Matrix.from_lists(I=list(range(step)), J=list(range(step)), V=[True] * step,
+                                     nrows=step, ncols=step, typ=types.BOOL)
+        has_changed = True
+        while has_changed:
             has_changed = False
-            for i, j, _ in closure:
-                if i in tensor_product.start_states and j in tensor_product.final_states:
-                    i_graph, j_graph = i % result.matrix_size, j % result.matrix_size
-                    i_rfa, j_rfa = i // result.matrix_size, j // result.matrix_size
-                    var = rfa.head_by_start_final_pair[i_rfa, j_rfa]
+            visited = result._traverse_product(rfa.graph, {
+                (state, state): identity for state in rfa.graph.start_states
+            })
+            with semiring.LOR_LAND_BOOL:
+                for (state_from, state_to), matrix in visited.items():
+                    var = rfa.head_by_start_final_pair.get((state_from, state_to))
+                    if var is None or state_to not in rfa.graph.final_states or not matrix.nvals:
+                        continue
+                    if var not in result.label_to_bool_matrix:
+                        result.label_to_bool_matrix[var] = Matrix.sparse(types.BOOL, step, step)
+                    old_nvals = result.label_to_bool_matrix[var].nvals
+                    result.label_to_bool_matrix[var] += matrix
+                    has_changed |= result.label_to_bool_matrix[var].nvals != old_nvals
+        return set([(i, j) for i, j, _ in result.label_to_bool_matrix.get(rfa.start_symbol, [])])
+
+    @staticmethod
+    def _cfpq_tensors_incremental(rfa, result) -> Set[Tuple[int, int]]:
+        step = result.matrix_size
+        empty_matrix = Matrix.sparse(types.BOOL, step, step)
+        tensor_product = rfa.graph.kronecker_product(result)
+        start_states, final_states = tensor_product.start_states, tensor_product.final_states
+        closure = tensor_product.build_closure_by_squaring()
+        new_pairs = closure
+        while new_pairs.nvals:
+            delta: Dict[Any, Matrix] = {}
+            for i, j, _ in new_pairs:
+                if i in start_states and j in final_states:
+                    i_graph, j_graph = i % step, j % step
+                    var = rfa.head_by_start_final_pair[i // step, j // step]
                     matrix = result.label_to_bool_matrix.setdefault(var, empty_matrix.dup())
                     if not matrix.get(i_graph, j_graph, False):
-                        has_changed = True
-                    matrix[i_graph, j_graph] = True
+                        matrix[i_graph, j_graph] = True
+                        delta.setdefault(var, empty_matrix.dup())[i_graph, j_graph] = True
+            if not delta:
+                break
+            delta_product = rfa.graph.kronecker_product(GraphWrapper._from_label_to_bool_matrix(delta))
+            new_edges = Matrix.sparse(types.BOOL, closure.nrows, closure.ncols)
+            with semiring.LOR_LAND_BOOL:
+                for _, matrix in delta_product.label_to_bool_matrix.items():
+                    new_edges += matrix
+            new_pairs = GraphWrapper._expand_closure(closure, new_edges)
         return set([(i, j) for i, j, _ in result.label_to_bool_matrix.get(rfa.start_symbol, [])])
@@ -0,0 +1,125 @@
+from typing import Dict, Any, Set, Tuple, Optional, List, Union
+
+import numpy as np
+from pyformlang.cfg import Terminal, Variable
+from pygraphblas import Matrix, semiring
+from pygraphblas import binaryop
+from pygraphblas import descriptor
+from pygraphblas import types
+
+from wrappers import GrammarWrapper
+from wrappers.GraphWrapper import GraphWrapper
+
+
+class MaintainedRPQ:
+    def __init__(self, graph: GraphWrapper, constraint: GraphWrapper,
+                 query: Dict[str, Union[bool, str, List[int]]]):
+        if query.get('reachability_between_all'):
+            self.from_indices, self.to_indices = None, None
+        elif 'reachability_from_set' in query:
+            self.from_indices = set(query.get('reachability_from_set'))
+            self.to_indices = set(query['reachability_to_set']) if 'reachability_to_set' in query else None
+        else:
+            raise KeyError("Incorrect format of the input query")
+        self.graph = graph
+        self.constraint = constraint
+        self.step = constraint.matrix_size
+        self.recompute()
+        graph.maintained_queries.append(self)
+
+    def recompute(self):
+        # With a source set only the rows of the source states are kept, not the all-pairs closure
+        self.closure = Matrix.sparse(types.BOOL, 0, 0)
+        self.edges = Matrix.sparse(types.BOOL, 0, 0)
+        self.on_edges_added(self.graph.label_to_bool_matrix)
+
+    def on_edges_added(self, added: Dict[Any, Matrix]):
+        # Product states are vertex-major (vertex * step + state), so growing the graph only appends states
+        size = self.graph.matrix_size * self.step
+        self.closure.resize(size, size)
+        new_edges = Matrix.sparse(types.BOOL, size, size)
+        with semiring.LOR_LAND_BOOL:
+            for label, matrix in added.items():
+                constraint_matrix = self.constraint.label_to_bool_matrix.get(label)
+                if constraint_matrix is not None:
+                    new_edges += matrix.kronecker(other=constraint_matrix, op=binaryop.TIMES)
+        if self.from_indices is None:
+            GraphWrapper._expand_closure(self.closure, new_edges)
+            return
+        self.edges.resize(size, size)
+        with semiring.LOR_LAND_BOOL:
+            self.edges += new_edges
+            # A newly reachable state is reached through a new edge leaving a source or an already reachable state
+            frontier = (self._get_source_states(size) + self.closure).mxm(new_edges, mask=self.closure,
+                                                                          desc=descriptor.RC)
+            while frontier.nvals:
+                self.closure += frontier
+                frontier = frontier.mxm(self.edges, mask=self.closure, desc=descriptor.RC)
+
+    def _get_source_states(self, size: int) -> Matrix:
+        sources = [vertex * self.step + state for vertex in self.from_indices if vertex < self.graph.matrix_size
+                   for state in self.constraint.start_states]
+        return Matrix.from_lists(I=sources, J=sources, V=[True] * len(sources), nrows=size, ncols=size,
+                                 typ=types.BOOL)
+
+    def get_reachable_pairs(self) -> Set[Tuple[int, int]]:
+        I, J, _ = self.closure.to_lists()
+        rows, cols = np.asarray(I, dtype=np.int64), np.asarray(J, dtype=np.int64)
+        keep = (np.isin(rows % self.step, list(self.constraint.start_states))
+                & np.isin(cols % self.step, list(self.constraint.final_states)))
+        if self.from_indices is not None:
+            keep &= np.isin(rows // self.step, list(self.from_indices))
+        if self.to_indices is not None:
+            keep &= np.isin(cols // self.step, list(self.to_indices))
+        return set(zip((rows[keep] // self.step).tolist(), (cols[keep] // self.step).tolist()))
+
+
+class MaintainedCFPQ:
+    def __init__(self, graph: GraphWrapper, grammar: GrammarWrapper):
+        self.graph = graph
+        self.grammar = grammar
+        self.term_productions, self.nonterm_productions = set(), set()
+        for production in grammar.cnf.productions:
+            if len(production.body) == 2:
+                self.nonterm_productions.add(production)
+            elif len(production.body) == 1:
+                self.term_productions.add(production)
+        self.recompute()
+        graph.maintained_queries.append(self)
+
+    def recompute(self):
+        self.result: Dict[Variable, Matrix] = {}
+        self.eps_vertices: Set[int] = set()
+        self.on_edges_added(self.graph.label_to_bool_matrix)
+
+    def on_edges_added(self, added: Dict[Any, Matrix]):
+        size = self.graph.matrix_size
+        for matrix in self.result.values():
+            matrix.resize(size, size)
+        delta: Dict[Variable, Matrix] = {}
+        if self.grammar.generate_epsilon:
+            new_vertices = sorted(self.graph.vertices - self.eps_vertices)
+            if new_vertices:
+                delta[self.grammar.cfg.start_symbol] = Matrix.from_lists(
+                    I=new_vertices, J=new_vertices, V=[True] * len(new_vertices),
+                    nrows=size, ncols=size, typ=types.BOOL
+                )
+                self.eps_vertices.update(new_vertices)
+        with semiring.LOR_LAND_BOOL:
+            for label, matrix in added.items():
+                for production in self.term_productions:
+                    if Terminal(label) == production.body[0]:
+                        if production.head in delta:
+                            delta[production.head] += matrix
+                        else:
+                            delta[production.head] = matrix.dup()
+            for var, matrix in delta.items():
+                if var in self.result:
+                    self.result[var] += matrix
+                else:
+                    self.result[var] = matrix.dup()
+        self.graph._cfpq_matrices_delta(self.result, self.nonterm_productions, delta)
+
+    def get_reachable_pairs(self, symbol: Optional[Variable] = None) -> Set[Tuple[int, int]]:
+        symbol = self.grammar.cfg.start_symbol if symbol is None else symbol
+        return set([(i, j) for i, j, _ in self.result.get(symbol, [])])
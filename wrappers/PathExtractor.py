@@ -0,0 +1,123 @@
+from typing import Dict, Any, List, Tuple, Iterator, Optional, Set, Iterable, FrozenSet
+
+from pyformlang.cfg import Terminal, Production
+from pygraphblas import Matrix
+
+from wrappers.VertexMapping import VertexMapping
+
+Path = List[Tuple[int, Any, int]]
+
+
+class PathExtractor:
+    def __init__(self, lengths: Dict[Any, Matrix], productions: Iterable[Production],
+                 eps_heads: Set[Any], start_symbol: Any, vertices_num: int):
+        self.start_symbol = start_symbol
+        self.vertices_num = vertices_num
+        self.eps_heads = set(eps_heads)
+        self.bodies_by_head: Dict[Any, List[List[Any]]] = {}
+        for production in productions:
+            if production.body:
+                self.bodies_by_head.setdefault(production.head, []).append(list(production.body))
+        # Lengths stay in the matrices, only the rows visited by the extraction are read out
+        self.lengths = lengths
+        self.__rows: Dict[Tuple[Any, int], List[Tuple[int, int]]] = {}
+
+    def get_shortest_length(self, node_from: int, node_to: int, symbol: Any = None) -> Optional[int]:
+        symbol = self.start_symbol if symbol is None else symbol
+        matrix = self.lengths.get(symbol)
+        return None if matrix is None else matrix.get(node_from, node_to)
+
+    def _get_row(self, symbol: Any, node_from: int) -> List[Tuple[int, int]]:
+        key = (symbol, node_from)
+        if key not in self.__rows:
+            matrix = self.lengths.get(symbol)
+            if matrix is None:
+                self.__rows[key] = []
+            else:
+                _, J, V = matrix.extract_matrix([node_from], None).to_lists()
+                self.__rows[key] = list(zip(J, V))
+        return self.__rows[key]
+
+    def get_paths(self, node_from: int, node_to: int, k: int = 1,
+                  max_length: Optional[int] = None) -> Iterator[Path]:
+        shortest = self.get_shortest_length(node_from, node_to)
+        if shortest is None:
+            return
+        if max_length is None:
+            max_length = shortest + self.vertices_num
+        found: Set[Tuple[Tuple[int, Any, int], ...]] = set()
+        for length in range(shortest, max_length + 1):
+            for path in self._get_paths(node_from, node_to, self.start_symbol, length, frozenset()):
+                if tuple(path) in found:
+                    continue
+                found.add(tuple(path))
+                yield path
+                if len(found) >= k:
+                    return
+
+    def get_shortest_path(self, node_from: int, node_to: int) -> Optional[Path]:
+        return next(self.get_paths(node_from, node_to, k=1), None)
+
+    def _get_paths(self, node_from: int, node_to: int, symbol: Any, length: int,
+                   ancestors: FrozenSet) -> Iterator[Path]:
+        shortest = self.get_shortest_length(node_from, node_to, symbol)
+        if shortest is None or shortest > length:
+            return
+        if isinstance(symbol, Terminal):
+            if length == 1:
+                yield [(node_from, symbol.value, node_to)]
+            return
+        key = (node_from, node_to, symbol, length)
+        if key in ancestors:
+            return
+        ancestors = ancestors | {key}
+        if length == 0 and node_from == node_to and symbol in self.eps_heads:
+            yield []
+        for body in self.bodies_by_head.get(symbol, []):
+            yield from self._get_paths_for_body(node_from, node_to, body, length, ancestors)
+
+    def _get_paths_for_body(self, node_from: int, node_to: int, body: List[Any],
+                            length: int, ancestors: FrozenSet) -> Iterator[Path]:
+        first, rest = body[0], body[1:]
+        if not rest:
+            yield from self._get_paths(node_from, node_to, first, length, ancestors)
+            return
+        for node_middle, first_shortest in self._get_row(first, node_from):
+            if len(rest) == 1:
+                rest_shortest = self.get_shortest_length(node_middle, node_to, rest[0])
+                if rest_shortest is None:
+                    continue
+            else:
+                rest_shortest = 0
+            for first_length in range(first_shortest, length - rest_shortest + 1):
+                rest_length = length - first_length
+                if next(self._get_paths_for_body(node_middle, node_to, rest, rest_length, ancestors), None) is None:
+                    continue
+                for prefix in self._get_paths(node_from, node_middle, first, first_length, ancestors):
+                    for suffix in self._get_paths_for_body(node_middle, node_to, rest, rest_length, ancestors):
+                        yield prefix + suffix
+
+
+class MappedPathExtractor:
+    def __init__(self, extractor, mapping: VertexMapping):
+        # Paths are extracted on a renumbered graph, mapping.names[i] is the vertex i of that graph
+        self.extractor = extractor
+        self.mapping = mapping
+
+    def get_shortest_length(self, node_from: Any, node_to: Any, symbol: Any = None) -> Optional[int]:
+        if node_from not in self.mapping.index_by_name or node_to not in self.mapping.index_by_name:
+            return None
+        return self.extractor.get_shortest_length(self.mapping.index_by_name[node_from],
+                                                  self.mapping.index_by_name[node_to], symbol)
+
+    def get_paths(self, node_from: Any, node_to: Any, k: int = 1,
+                  max_length: Optional[int] = None) -> Iterator[Path]:
+        if node_from not in self.mapping.index_by_name or node_to not in self.mapping.index_by_name:
+            return
+        names = self.mapping.names
+        for path in self.extractor.get_paths(self.mapping.index_by_name[node_from],
+                                             self.mapping.index_by_name[node_to], k, max_length):
+            yield [(names[v], label, names[u]) for v, label, u in path]
+
+    def get_shortest_path(self, node_from: Any, node_to: Any) -> Optional[Path]:
+        return next(self.get_paths(node_from, node_to, k=1), None)
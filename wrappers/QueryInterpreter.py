@@ -0,0 +1,305 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from pyformlang.cfg import CFG, Production, Terminal, Variable
+from pygraphblas import Matrix, semiring
+from pygraphblas import descriptor
+from pygraphblas import types
+
+from wrappers.GrammarWrapper import GrammarWrapper
+from wrappers.GraphCatalog import GraphCatalog
+from wrappers.GraphWrapper import GraphWrapper, ProductStates
+from wrappers.ParseTreeWrapper import ParseTreeWrapper
+from wrappers.RFA import RFA
+
+EdgeMasks = Dict[Any, Matrix]
+Predicate = Callable[[GraphWrapper, EdgeMasks], EdgeMasks]
+Labels = Optional[Set[Any]]
+
+
+def _diagonal(size: int, vertices: Iterable[int]) -> Matrix:
+    if isinstance(vertices, ProductStates):
+        indices = vertices.to_array()
+        indices = indices[indices < size].tolist()
+    else:
+        indices = sorted(set(idx for idx in vertices if 0 <= idx < size))
+    return Matrix.from_lists(I=indices, J=indices, V=[True] * len(indices), nrows=size, ncols=size, typ=types.BOOL)
+
+
+def _restrict(masks: EdgeMasks, vertices: Iterable[int], by_rows: bool) -> EdgeMasks:
+    restricted: EdgeMasks = {}
+    selection_by_size: Dict[int, Matrix] = {}
+    with semiring.LOR_LAND_BOOL:
+        for label, matrix in masks.items():
+            if matrix.nrows not in selection_by_size:
+                selection_by_size[matrix.nrows] = _diagonal(matrix.nrows, vertices)
+            selection = selection_by_size[matrix.nrows]
+            restricted[label] = selection @ matrix if by_rows else matrix @ selection
+    return restricted
+
+
+def _select_labels(masks: EdgeMasks, labels: Labels) -> EdgeMasks:
+    if labels is None:
+        return masks
+    return {label: matrix for label, matrix in masks.items() if str(label) in labels}
+
+
+def _union(left: EdgeMasks, right: EdgeMasks) -> EdgeMasks:
+    united = dict(left)
+    with semiring.LOR_LAND_BOOL:
+        for label, matrix in right.items():
+            united[label] = united[label] + matrix if label in united else matrix
+    return united
+
+
+def _difference(left: EdgeMasks, right: EdgeMasks) -> EdgeMasks:
+    difference: EdgeMasks = {}
+    with semiring.LOR_LAND_BOOL:
+        for label, matrix in left.items():
+            if label not in right:
+                difference[label] = matrix
+            else:
+                difference[label] = matrix.emult(matrix, mask=right[label], desc=descriptor.RC)
+    return difference
+
+
+class LoadGraph:
+    def __init__(self, catalog: GraphCatalog, path_to_graph: str):
+        self.catalog = catalog
+        self.path_to_graph = path_to_graph
+
+    def evaluate(self, labels: Labels = None) -> GraphWrapper:
+        return self.catalog.load(self.path_to_graph)
+
+
+class GrammarQuery:
+    def __init__(self, grammar: GrammarWrapper):
+        self.grammar = grammar
+
+    def evaluate(self, labels: Labels = None) -> GraphWrapper:
+        return RFA.from_cfg(self.grammar.cfg).graph
+
+
+class SetStartAndFinal:
+    def __init__(self, start_states: Optional[Set[int]], final_states: Optional[Set[int]], source):
+        self.start_states = start_states
+        self.final_states = final_states
+        self.source = source
+
+    def evaluate(self, labels: Labels = None) -> GraphWrapper:
+        source = self.source.evaluate(labels)
+        graph = GraphWrapper.empty()
+        graph.label_to_bool_matrix = source.label_to_bool_matrix
+        graph.matrix_size = source.matrix_size
+        graph.vertices = source.vertices
+        graph.start_states = source.start_states if self.start_states is None else self.start_states
+        graph.final_states = source.final_states if self.final_states is None else self.final_states
+        return graph
+
+
+class Intersect:
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+
+    def evaluate(self, labels: Labels = None) -> GraphWrapper:
+        if isinstance(self.left, GrammarQuery) and isinstance(self.right, GrammarQuery):
+            raise ValueError('Intersection of two context-free queries is not supported')
+        if isinstance(self.left, GrammarQuery) or isinstance(self.right, GrammarQuery):
+            query, source = (self.left, self.right) if isinstance(self.left, GrammarQuery) else (self.right, self.left)
+            return Intersect._solve_cfpq(query.grammar, source.evaluate())
+        # Only the kron blocks of labels the objective can select are built
+        return self.left.evaluate(labels).kronecker_product(self.right.evaluate(labels), labels=labels)
+
+    @staticmethod
+    def _solve_cfpq(grammar: GrammarWrapper, graph: GraphWrapper) -> GraphWrapper:
+        vertices = set(graph.vertices)
+        from_vertices = None if vertices <= set(graph.start_states) else graph.start_states
+        to_vertices = None if vertices <= set(graph.final_states) else graph.final_states
+        pairs = graph.cfpq_matrices(grammar, mode='delta', from_vertices=from_vertices, to_vertices=to_vertices)
+        answer = GraphWrapper.empty()
+        answer._build_label_matrices({grammar.cfg.start_symbol.value: ([i for i, _ in pairs], [j for _, j in pairs])},
+                                     graph.matrix_size)
+        answer.vertices = graph.vertices
+        answer.start_states = graph.start_states
+        answer.final_states = graph.final_states
+        return answer
+
+
+class SelectEdges:
+    def __init__(self, source):
+        self.source = source
+
+    def evaluate_masks(self, labels: Labels = None) -> Tuple[GraphWrapper, EdgeMasks]:
+        graph = self.source.evaluate(labels)
+        return graph, _select_labels(graph.label_to_bool_matrix, labels)
+
+    def evaluate(self) -> Set[Tuple[int, Any, int]]:
+        _, masks = self.evaluate_masks()
+        return set([(i, label, j) for label, matrix in masks.items() for i, j, _ in matrix])
+
+
+class FilterEdges(SelectEdges):
+    def __init__(self, predicate: Predicate, labels: Labels, source: SelectEdges):
+        super().__init__(source)
+        self.predicate = predicate
+        self.labels = labels
+
+    def evaluate_masks(self, labels: Labels = None) -> Tuple[GraphWrapper, EdgeMasks]:
+        if self.labels is not None:
+            labels = self.labels if labels is None else labels & self.labels
+        graph, masks = self.source.evaluate_masks(labels)
+        return graph, self.predicate(graph, masks)
+
+
+class CountEdges:
+    def __init__(self, source: SelectEdges):
+        self.source = source
+
+    def evaluate(self) -> int:
+        _, masks = self.source.evaluate_masks()
+        return sum([matrix.nvals for matrix in masks.values()])
+
+
+class QueryInterpreter:
+    def __init__(self, path_to_db: Optional[str] = None, catalog: Optional[GraphCatalog] = None):
+        self.catalog = GraphCatalog() if catalog is None else catalog
+        if path_to_db is not None:
+            self.catalog.path_to_db = path_to_db
+        self.productions: Set[Production] = set()
+        self.start_symbol: Optional[Variable] = None
+        self.__aux_var_counter = 0
+
+    def run(self, script: ParseTreeWrapper) -> List[Union[Set[Tuple[int, Any, int]], int]]:
+        if script.ast is None:
+            raise ValueError('Script cannot be parsed')
+        results = []
+        for stmt in script.ast.stmt():
+            plan = self.compile_statement(stmt)
+            if plan is not None:
+                results.append(plan.evaluate())
+        return results
+
+    def compile_statement(self, ctx) -> Optional[Union[SelectEdges, CountEdges]]:
+        if ctx.CONNECT():
+            self.catalog.path_to_db = ctx.PATH().getText()
+            return None
+        if ctx.PRODUCTION():
+            head = self._compile_variable(ctx.variable())
+            if self.start_symbol is None:
+                self.start_symbol = head
+            self.productions.add(Production(head, self._compile_pattern(ctx.pattern(), self.productions)))
+            return None
+        return self._compile_objective(ctx.objective(), self._compile_graph(ctx.graph()))
+
+    def _compile_graph(self, ctx):
+        graphs = ctx.graph()
+        if ctx.INTERSECT():
+            return Intersect(self._compile_graph(graphs[0]), self._compile_graph(graphs[1]))
+        if ctx.NAME():
+            return LoadGraph(self.catalog, self.catalog.resolve(ctx.STRING().getText()))
+        if ctx.SET_START_AND_FINAL():
+            return SetStartAndFinal(self._compile_vertices(ctx.vertices(0)), self._compile_vertices(ctx.vertices(1)),
+                                    self._compile_graph(graphs[0]))
+        if ctx.QUERY():
+            return GrammarQuery(self._get_grammar(ctx.pattern()))
+        return self._compile_graph(graphs[0])
+
+    def _compile_vertices(self, ctx) -> Optional[Set[int]]:
+        if ctx.NONE():
+            return None
+        if ctx.RANGE():
+            return set(range(int(ctx.INT(0).getText()), int(ctx.INT(1).getText()) + 1))
+        if ctx.seq():
+            return set([int(token.getText()) for token in ctx.seq().INT()])
+        return self._compile_vertices(ctx.vertices())
+
+    def _compile_objective(self, ctx, graph) -> Union[SelectEdges, CountEdges]:
+        if ctx.COUNT():
+            return CountEdges(self._compile_edges(ctx.edges(), graph))
+        if ctx.edges():
+            return self._compile_edges(ctx.edges(), graph)
+        return self._compile_objective(ctx.objective(), graph)
+
+    def _compile_edges(self, ctx, graph) -> SelectEdges:
+        if ctx.EDGES():
+            return SelectEdges(graph)
+        if ctx.FILTER():
+            names = [token.getText() for token in ctx.predicate().STRING()]
+            predicate, labels = self._compile_bool_expr(ctx.predicate().bool_expr(), names)
+            return FilterEdges(predicate, labels, self._compile_edges(ctx.edges(), graph))
+        return self._compile_edges(ctx.edges(), graph)
+
+    def _compile_bool_expr(self, ctx, names: List[str]) -> Tuple[Predicate, Labels]:
+        # Besides the predicate itself, collects labels outside of which it never holds (None if there is no bound)
+        exprs = ctx.bool_expr()
+        if ctx.AND():
+            (left, left_labels), (right, right_labels) = [self._compile_bool_expr(expr, names) for expr in exprs]
+            labels = right_labels if left_labels is None else left_labels if right_labels is None \
+                else left_labels & right_labels
+            return (lambda graph, masks: right(graph, left(graph, masks))), labels
+        if ctx.OR():
+            (left, left_labels), (right, right_labels) = [self._compile_bool_expr(expr, names) for expr in exprs]
+            labels = None if left_labels is None or right_labels is None else left_labels | right_labels
+            return (lambda graph, masks: _union(left(graph, masks), right(graph, masks))), labels
+        if ctx.NOT():
+            inner, _ = self._compile_bool_expr(exprs[0], names)
+            return (lambda graph, masks: _difference(masks, inner(graph, masks))), None
+        if ctx.HAS_LABEL():
+            name, label = [token.getText() for token in ctx.STRING()]
+            if name != names[1]:
+                raise ValueError(f'{name} is not an edge in predicate over ({", ".join(names)})')
+            return (lambda graph, masks: _select_labels(masks, {label})), {label}
+        if ctx.IS_START() or ctx.IS_FINAL():
+            name = ctx.STRING(0).getText()
+            if name not in (names[0], names[2]):
+                raise ValueError(f'{name} is not a vertex in predicate over ({", ".join(names)})')
+            by_rows = name == names[0]
+            if ctx.IS_START():
+                return (lambda graph, masks: _restrict(masks, graph.start_states, by_rows)), None
+            return (lambda graph, masks: _restrict(masks, graph.final_states, by_rows)), None
+        return self._compile_bool_expr(exprs[0], names)
+
+    def _compile_pattern(self, ctx, productions: Set[Production]) -> List[Union[Variable, Terminal]]:
+        if ctx.EPS():
+            return []
+        if ctx.terminal():
+            return [Terminal(ctx.terminal().STRING().getText())]
+        if ctx.variable():
+            return [self._compile_variable(ctx.variable())]
+        patterns = ctx.pattern()
+        if ctx.CONCAT():
+            return self._compile_pattern(patterns[0], productions) + self._compile_pattern(patterns[1], productions)
+        if ctx.ALT():
+            aux_var = self._get_aux_var()
+            productions.add(Production(aux_var, self._compile_pattern(patterns[0], productions)))
+            productions.add(Production(aux_var, self._compile_pattern(patterns[1], productions)))
+            return [aux_var]
+        body = self._compile_pattern(patterns[0], productions)
+        if not (ctx.STAR() or ctx.PLUS() or ctx.OPTION()):
+            return body
+        aux_var = self._get_aux_var()
+        productions.add(Production(aux_var, body if ctx.PLUS() else []))
+        productions.add(Production(aux_var, body if ctx.OPTION() else body + [aux_var]))
+        return [aux_var]
+
+    @staticmethod
+    def _compile_variable(ctx) -> Variable:
+        return Variable(ctx.STRING().getText())
+
+    def _get_aux_var(self) -> Variable:
+        # '$' never occurs in names of the query language, so auxiliary variables cannot clash with user ones
+        self.__aux_var_counter += 1
+        return Variable(f'${self.__aux_var_counter}')
+
+    def _get_grammar(self, pattern_ctx) -> GrammarWrapper:
+        productions = set(self.productions)
+        start_symbol = self.start_symbol
+        if pattern_ctx is not None:
+            start_symbol = self._get_aux_var()
+            productions.add(Production(start_symbol, self._compile_pattern(pattern_ctx, productions)))
+        if start_symbol is None:
+            raise ValueError('There are no productions to build the query grammar from')
+        variables = set([production.head for production in productions])
+        terminals = set([symbol for production in productions for symbol in production.body
+                         if isinstance(symbol, Terminal)])
+        return GrammarWrapper(CFG(variables, terminals, start_symbol, productions))
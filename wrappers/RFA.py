@@ -1,12 +1,16 @@
-from typing import List
+from typing import List, Dict, Any
 
 from pyformlang.cfg import Variable, Production, CFG
 from pyformlang.finite_automaton import DeterministicFiniteAutomaton
 from pyformlang.regular_expression import Regex
 from pygraphblas import Matrix, types
 
+from wrappers.ArtifactCache import ArtifactCache
+
 
 class RFA:
+    cache = ArtifactCache()
+
     def __init__(self, graph, head_by_start_final_pair, eps_productions, start_symbol):
         self.graph = graph
         self.head_by_start_final_pair = head_by_start_final_pair
@@ -79,6 +83,39 @@ class RFA:
         return cls(rfa_graph, head_by_start_final_pair, eps_productions, start_symbol)
 
     @classmethod
-    def from_file(cls, path_to_file: str):
+    def from_file(cls, path_to_file: str, use_cache=True):
         with open(path_to_file, 'r') as file:
-            return cls.from_text(file.readlines())
+            text = file.read()
+        if not use_cache:
+            return cls.from_text(text.splitlines())
+        key = ArtifactCache.get_key('rfa', text)
+        compiled = cls.cache.get(key)
+        if compiled is not None:
+            return cls._from_compiled(compiled)
+        rfa = cls.from_text(text.splitlines())
+        cls.cache.put(key, rfa._to_compiled())
+        return rfa
+
+    def _to_compiled(self) -> Dict[str, Any]:
+        return {
+            'label_to_edges': {label: tuple(matrix.to_lists()[:2])
+                               for label, matrix in self.graph.label_to_bool_matrix.items()},
+            'matrix_size': self.graph.matrix_size,
+            'vertices': set(self.graph.vertices),
+            'start_states': set(self.graph.start_states),
+            'final_states': set(self.graph.final_states),
+            'head_by_start_final_pair': self.head_by_start_final_pair,
+            'eps_productions': self.eps_productions,
+            'start_symbol': self.start_symbol
+        }
+
+    @classmethod
+    def _from_compiled(cls, compiled: Dict[str, Any]):
+        import wrappers.GraphWrapper
+        rfa_graph = wrappers.GraphWrapper.empty()
+        rfa_graph._build_label_matrices(compiled['label_to_edges'], compiled['matrix_size'])
+        rfa_graph.vertices = set(compiled['vertices'])
+        rfa_graph.start_states = set(compiled['start_states'])
+        rfa_graph.final_states = set(compiled['final_states'])
+        return cls(rfa_graph, dict(compiled['head_by_start_final_pair']), list(compiled['eps_productions']),
+                   compiled['start_symbol'])
@@ -1,38 +1,82 @@
-from typing import Dict
+from typing import Dict, NamedTuple, Any, Tuple, List
 
 from pyformlang.finite_automaton import EpsilonNFA, DeterministicFiniteAutomaton, State
 from pyformlang.regular_expression import Regex
 
-from wrappers import GraphWrapper, Edge
+from wrappers import GraphWrapper
+from wrappers.ArtifactCache import ArtifactCache
+
+
+class CompiledRegex(NamedTuple):
+    label_to_edges: Dict[Any, Tuple[List[int], List[int]]]
+    start_states: List[int]
+    final_states: List[int]
 
 
 class RegexGraphWrapper(GraphWrapper):
     dfa: DeterministicFiniteAutomaton
     dfa_state_to_idx: Dict[State, int]
+    cache = ArtifactCache()
 
     def __init__(self, epsilon_nfa: EpsilonNFA):
-        edges = []
+        label_to_edges: Dict[Any, Tuple[List[int], List[int]]] = {}
         dfa = epsilon_nfa.to_deterministic()
         state_to_idx = dict([(state, index) for index, state in enumerate(dfa.states)])
-        for state_from, transitions in epsilon_nfa.to_deterministic().to_dict().items():
+        for state_from, transitions in dfa.to_dict().items():
             for label, state_to in transitions.items():
-                edges.append(Edge(node_from=state_to_idx[state_from], node_to=state_to_idx[state_to], label=label))
+                I, J = label_to_edges.setdefault(label, ([], []))
+                I.append(state_to_idx[state_from])
+                J.append(state_to_idx[state_to])
         self.dfa = dfa
         self.dfa_state_to_idx = state_to_idx
         start_states = [self.dfa_state_to_idx[state] for state in self.dfa.start_states]
         final_states = [self.dfa_state_to_idx[state] for state in self.dfa.final_states]
-        super().__init__(edges, set(start_states), set(final_states))
+        self._init_from_compiled(CompiledRegex(label_to_edges, start_states, final_states))
+
+    def _init_from_compiled(self, compiled: CompiledRegex):
+        super().__init__([], set(compiled.start_states), set(compiled.final_states))
+        self._build_label_matrices(compiled.label_to_edges)
+        self.compiled = compiled
 
     @classmethod
-    def from_regex(cls, regex: str, is_python_regex=True):
-        if is_python_regex:
-            pyformlang_regex = Regex.from_python_regex(regex)
-        else:
-            pyformlang_regex = Regex(regex)
-        return RegexGraphWrapper(pyformlang_regex.to_epsilon_nfa().minimize())
+    def _from_compiled(cls, compiled: CompiledRegex):
+        # The automaton is rebuilt from the cached edges, its states are named by their indices
+        instance = cls.__new__(cls)
+        instance.dfa = DeterministicFiniteAutomaton()
+        for label, (I, J) in compiled.label_to_edges.items():
+            for i, j in zip(I, J):
+                instance.dfa.add_transition(State(i), label, State(j))
+        for idx in compiled.start_states:
+            instance.dfa.add_start_state(State(idx))
+        for idx in compiled.final_states:
+            instance.dfa.add_final_state(State(idx))
+        instance.dfa_state_to_idx = dict([(state, state.value) for state in instance.dfa.states])
+        instance._init_from_compiled(compiled)
+        return instance
 
     @classmethod
-    def from_regex_file(cls, path_to_regex_file: str, is_python_regex=True):
+    def from_regex(cls, regex: str, is_python_regex=True, use_cache=True):
+        normalized_regex = regex.strip() if is_python_regex else ' '.join(regex.split())
+        if not use_cache:
+            return cls._compile_regex(normalized_regex, is_python_regex)
+        key = ArtifactCache.get_key('python' if is_python_regex else 'pyformlang', normalized_regex)
+        compiled = cls.cache.get(key)
+        if compiled is not None:
+            return cls._from_compiled(compiled)
+        instance = cls._compile_regex(normalized_regex, is_python_regex)
+        cls.cache.put(key, instance.compiled)
+        return instance
+
+    @classmethod
+    def from_regex_file(cls, path_to_regex_file: str, is_python_regex=True, use_cache=True):
         with open(path_to_regex_file, 'r') as file:
             line = file.readline()
-        return cls.from_regex(line, is_python_regex)
+        return cls.from_regex(line, is_python_regex, use_cache)
+
+    @classmethod
+    def _compile_regex(cls, regex: str, is_python_regex: bool):
+        if is_python_regex:
+            pyformlang_regex = Regex.from_python_regex(regex)
+        else:
+            pyformlang_regex = Regex(regex)
+        return cls(pyformlang_regex.to_epsilon_nfa().minimize())
@@ -0,0 +1,38 @@
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+import numpy as np
+
+
+class VertexMapping:
+    def __init__(self, names: Iterable[Any]):
+        # Internal vertex i of a compacted graph is the external vertex names[i]
+        self.names: List[Any] = list(names)
+        self.index_by_name: Dict[Any, int] = {name: idx for idx, name in enumerate(self.names)}
+        self._names_array = np.asarray(self.names)
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable[str]):
+        tokens = list(tokens)
+        if all([token.lstrip('-').isdigit() for token in tokens]):
+            return cls([int(token) for token in tokens])
+        return cls(tokens)
+
+    def reordered(self, order: Iterable[int]):
+        return VertexMapping([self.names[idx] for idx in order])
+
+    def to_internal(self, names: Iterable[Any]) -> List[int]:
+        return [self.index_by_name[name] for name in names if name in self.index_by_name]
+
+    def to_external(self, indices: Iterable[int]) -> List[Any]:
+        return [self.names[idx] for idx in indices]
+
+    def to_external_pairs(self, pairs: Iterable[Tuple[int, int]]) -> Set[Tuple[Any, Any]]:
+        return set([(self.names[i], self.names[j]) for i, j in pairs])
+
+    def to_external_arrays(self, rows: np.ndarray, cols: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.names:
+            return rows, cols
+        return self._names_array[rows], self._names_array[cols]
+
+    def __len__(self) -> int:
+        return len(self.names)
@@ -1,5 +1,10 @@
 from wrappers.RFA import RFA
 from wrappers.GrammarWrapper import GrammarWrapper
+from wrappers.PathExtractor import PathExtractor, MappedPathExtractor
+from wrappers.VertexMapping import VertexMapping
 from wrappers.GraphWrapper import GraphWrapper, Edge
 from wrappers.RegexGraphWrapper import RegexGraphWrapper
-from wrappers.ParseTreeWrapper import ParseTreeWrapper
\ No newline at end of file
+from wrappers.ParseTreeWrapper import ParseTreeWrapper
+from wrappers.GraphCatalog import GraphCatalog
+from wrappers.MaintainedQuery import MaintainedRPQ, MaintainedCFPQ
+from wrappers.QueryInterpreter import QueryInterpreter